@@ -0,0 +1,11 @@
+"""
+Benchmarks of the security application. They are not part of the installed package, every benchmark is a module
+runnable from the repository root, e.g.::
+
+    python -m benchmarks.run --sizes 10000,100000,1000000 > results.json
+    python -m benchmarks.middleware --engine postgresql --name security_benchmark
+    python -m benchmarks.purge --sizes 100000
+    python -m benchmarks.indexes --rows 1000000
+
+All benchmarks write their results as JSON to the standard output.
+"""
@@ -0,0 +1,127 @@
+"""
+Compares query plans and latency of the throttling and purge queries without and with LoggedRequest indexes.
+"""
+import random
+
+from datetime import timedelta
+
+from .utils import (get_argument_parser, setup_django, truncate_logged_requests, generate_logged_requests, get_ips,
+                    get_paths, measure, summarize, dump_results)
+
+
+# Must match indexes of security.models.LoggedRequest
+LOGGED_REQUEST_INDEXES = (
+    ('request_timestamp',),
+    ('ip', 'path', 'method', 'request_timestamp'),
+    ('ip', 'path', 'type', 'request_timestamp'),
+)
+
+
+def get_index_names(cursor, connection, table):
+    if connection.vendor == 'postgresql':
+        cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = %s AND indexname NOT LIKE '%%_pkey'",
+                       [table])
+    else:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL",
+                       [table])
+    return [row[0] for row in cursor.fetchall()]
+
+
+def drop_indexes():
+    from django.db import connection
+
+    from security.models import LoggedRequest
+
+    cursor = connection.cursor()
+    for name in get_index_names(cursor, connection, LoggedRequest._meta.db_table):
+        cursor.execute('DROP INDEX %s' % connection.ops.quote_name(name))
+
+
+def create_indexes():
+    from django.db import connection
+
+    from security.models import LoggedRequest
+
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    for i, columns in enumerate(LOGGED_REQUEST_INDEXES):
+        cursor.execute('CREATE INDEX %s ON %s (%s)' % (
+            qn('benchmark_loggedrequest_%s' % i), qn(LoggedRequest._meta.db_table), ', '.join(map(qn, columns))
+        ))
+    cursor.execute('ANALYZE')
+
+
+def explain(qs):
+    from django.db import connection
+
+    sql, params = qs.query.sql_with_params()
+    cursor = connection.cursor()
+    cursor.execute(('EXPLAIN %s' if connection.vendor == 'postgresql' else 'EXPLAIN QUERY PLAN %s') % sql, params)
+    return [' '.join(map(str, row)) for row in cursor.fetchall()]
+
+
+def run_queries(ips, paths, repeat, seed):
+    from django.utils import timezone
+
+    from security.models import LoggedRequest
+    from security.counters import DatabaseCounterBackend
+
+    rand = random.Random(seed)
+    backend = DatabaseCounterBackend()
+    counters = (
+        (3600, 'method', 'GET'),
+        (60, 'method', 'GET'),
+        (60, 'type', LoggedRequest.UNSUCCESSFUL_LOGIN_REQUEST),
+        (10 * 60, 'type', LoggedRequest.UNSUCCESSFUL_LOGIN_REQUEST),
+        (60, 'type', LoggedRequest.SUCCESSFUL_LOGIN_REQUEST),
+        (10 * 60, 'type', LoggedRequest.SUCCESSFUL_LOGIN_REQUEST),
+    )
+    now = timezone.now()
+    purge_qs = LoggedRequest.objects.filter(request_timestamp__lte=now - timedelta(hours=12))
+    backup_qs = LoggedRequest.objects.filter(
+        request_timestamp__range=(now - timedelta(hours=13), now - timedelta(hours=12))
+    ).order_by('pk')
+
+    return {
+        'throttling_count': summarize(measure(
+            lambda: backend.count(3600, rand.choice(ips), rand.choice(paths), method='GET'), repeat
+        )),
+        'throttling_count_many': summarize(measure(
+            lambda: backend.count_many(rand.choice(ips), rand.choice(paths), counters), repeat
+        )),
+        'purge_count': summarize(measure(purge_qs.count, max(1, repeat // 100))),
+        'backup_day_range': summarize(measure(lambda: list(backup_qs.values_list('pk', flat=True)),
+                                              max(1, repeat // 100))),
+        'plans': {
+            'throttling_count': explain(LoggedRequest.objects.filter(
+                ip=ips[0], path=paths[0], method='GET', request_timestamp__gte=now - timedelta(hours=1)
+            ).order_by()),
+            'purge_count': explain(purge_qs.order_by()),
+            'backup_day_range': explain(backup_qs),
+        }
+    }
+
+
+def main():
+    parser = get_argument_parser(__doc__)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--ips', type=int, default=1000)
+    parser.add_argument('--paths', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=1000)
+    args = parser.parse_args()
+
+    setup_django(args.engine, args.name)
+    truncate_logged_requests()
+    drop_indexes()
+    generate_logged_requests(args.rows, ips=args.ips, paths=args.paths, seed=args.seed)
+
+    ips, paths = get_ips(args.ips), get_paths(args.paths)
+    results = {'rows': args.rows, 'engine': args.engine}
+    results['without_indexes'] = run_queries(ips, paths, args.repeat, args.seed)
+    create_indexes()
+    results['with_indexes'] = run_queries(ips, paths, args.repeat, args.seed)
+    dump_results(results)
+
+
+if __name__ == '__main__':
+    main()
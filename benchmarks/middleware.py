@@ -0,0 +1,66 @@
+"""
+Measures p50/p99 latency of LogMiddleware (process_request -> process_view -> process_response) with and without
+throttling validators for LoggedRequest tables of different sizes.
+"""
+import random
+
+from .utils import (get_argument_parser, setup_django, truncate_logged_requests, generate_logged_requests, get_ips,
+                    get_paths, measure, summarize, dump_results)
+
+
+def view(request):
+    from django.http import HttpResponse
+
+    return HttpResponse('OK')
+
+
+def exempt_view(request):
+    return view(request)
+exempt_view.throttling_exempt = True
+
+
+def measure_middleware(middleware, callback, ips, paths, repeat, seed):
+    from django.test.client import RequestFactory
+
+    factory = RequestFactory()
+    rand = random.Random(seed)
+
+    def process():
+        request = factory.get(rand.choice(paths), REMOTE_ADDR=rand.choice(ips))
+        middleware.process_request(request)
+        response = middleware.process_view(request, callback, (), {}) or callback(request)
+        middleware.process_response(request, response)
+
+    # First requests compile the view plans and warm up connections
+    measure(process, 10)
+    return summarize(measure(process, repeat))
+
+
+def run(sizes, repeat=1000, ips=1000, paths=100, seed=0):
+    from security.middleware import LogMiddleware
+
+    results = {}
+    for size in sizes:
+        truncate_logged_requests()
+        generate_logged_requests(size, ips=ips, paths=paths, seed=seed)
+        ip_list, path_list = get_ips(ips), get_paths(paths)
+        middleware = LogMiddleware()
+        results[str(size)] = {
+            'with_validators': measure_middleware(middleware, view, ip_list, path_list, repeat, seed),
+            'without_validators': measure_middleware(middleware, exempt_view, ip_list, path_list, repeat, seed),
+        }
+    return results
+
+
+def main():
+    parser = get_argument_parser(__doc__)
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--repeat', type=int, default=1000)
+    args = parser.parse_args()
+
+    setup_django(args.engine, args.name)
+    dump_results(run([int(size) for size in args.sizes.split(',')], args.repeat, seed=args.seed))
+
+
+if __name__ == '__main__':
+    main()
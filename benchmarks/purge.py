@@ -0,0 +1,97 @@
+"""
+Measures backup and purge throughput (requests/s) of purgeloggedrequests for LoggedRequest tables of different sizes.
+"""
+import shutil
+import tempfile
+import time
+
+from datetime import timedelta
+
+from django.utils.six import StringIO
+
+from .utils import (get_argument_parser, setup_django, truncate_logged_requests, generate_logged_requests,
+                    dump_results)
+
+
+def get_purge_queryset():
+    from django.utils import timezone
+
+    from security.models import LoggedRequest
+
+    # Generated requests are spread over two days, the older one is purged
+    return LoggedRequest.objects.filter(request_timestamp__lte=timezone.now() - timedelta(days=1))
+
+
+def measure_backup(size, backup_format, workers, seed):
+    from security.backup import backup_days
+
+    truncate_logged_requests()
+    generate_logged_requests(size, days=2, seed=seed)
+    directory = tempfile.mkdtemp()
+    try:
+        start = time.time()
+        results = list(backup_days(get_purge_queryset(), directory, backup_format, workers))
+        elapsed = time.time() - start
+    finally:
+        shutil.rmtree(directory)
+
+    rows = sum(result.rows for result in results)
+    return {
+        'rows': rows,
+        'seconds': elapsed,
+        'rows_per_second': rows / elapsed,
+        'bytes': sum(result.compressed_size for result in results),
+        'uncompressed_bytes': sum(result.size for result in results),
+    }
+
+
+def measure_purge(size, batch_size, seed):
+    from security.management.commands.purgeloggedrequests import Command
+
+    truncate_logged_requests()
+    generate_logged_requests(size, days=2, seed=seed)
+    qs = get_purge_queryset()
+    rows = qs.count()
+
+    start = time.time()
+    if batch_size:
+        command = Command()
+        command.stdout = StringIO()
+        command.purge_in_batches(qs, batch_size, 'pk', 0, None, None)
+    else:
+        qs.delete()
+    elapsed = time.time() - start
+    return {
+        'rows': rows,
+        'seconds': elapsed,
+        'rows_per_second': rows / elapsed,
+    }
+
+
+def run(sizes, backup_formats=('json', 'ndjson'), workers=1, batch_size=10000, seed=0):
+    results = {}
+    for size in sizes:
+        results[str(size)] = {
+            'backup': dict((backup_format, measure_backup(size, backup_format, workers, seed))
+                           for backup_format in backup_formats),
+            'purge': measure_purge(size, None, seed),
+            'purge_in_batches': measure_purge(size, batch_size, seed),
+        }
+    return results
+
+
+def main():
+    parser = get_argument_parser(__doc__)
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--backup-formats', default='json,ndjson')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    setup_django(args.engine, args.name)
+    dump_results(run([int(size) for size in args.sizes.split(',')], args.backup_formats.split(','), args.workers,
+                     args.batch_size, args.seed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Runs middleware and purge benchmarks against SQLite and against local PostgreSQL if it is available, results of all
+engines are emitted as one JSON document so they can be compared between versions.
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+
+from .utils import get_argument_parser, setup_django, dump_results
+
+
+def is_postgresql_available(name):
+    try:
+        import psycopg2
+    except ImportError:
+        return False
+
+    try:
+        psycopg2.connect(dbname=name, user=os.environ.get('PGUSER', ''), password=os.environ.get('PGPASSWORD', ''),
+                         host=os.environ.get('PGHOST', ''), port=os.environ.get('PGPORT', '')).close()
+    except psycopg2.Error:
+        return False
+    return True
+
+
+def run_engine(args):
+    """
+    Runs benchmarks of one engine in the current process, Django can be configured only once per process.
+    """
+    import django
+
+    from security.version import get_version
+
+    from . import middleware, purge
+
+    setup_django(args.engine, args.name)
+    sizes = [int(size) for size in args.sizes.split(',')]
+    return {
+        'security_version': get_version(),
+        'django_version': django.get_version(),
+        'python_version': platform.python_version(),
+        'engine': args.engine,
+        'middleware': middleware.run(sizes, args.repeat, seed=args.seed),
+        'purge': purge.run(sizes, seed=args.seed),
+    }
+
+
+def main():
+    parser = get_argument_parser(__doc__)
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--repeat', type=int, default=1000)
+    parser.add_argument('--single', action='store_true', help='Runs only the selected engine.')
+    args = parser.parse_args()
+
+    if args.single:
+        dump_results(run_engine(args))
+        return
+
+    engines = ['sqlite']
+    if is_postgresql_available(args.name or 'security_benchmark'):
+        engines.append('postgresql')
+
+    results = {}
+    for engine in engines:
+        command = [sys.executable, '-m', 'benchmarks.run', '--single', '--engine', engine, '--sizes', args.sizes,
+                   '--repeat', str(args.repeat), '--seed', str(args.seed)]
+        if args.name and engine == 'postgresql':
+            command += ['--name', args.name]
+        results[engine] = json.loads(subprocess.check_output(command).decode('utf-8'))
+    dump_results(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+import os
+import random
+import sys
+import time
+
+from argparse import ArgumentParser
+from datetime import timedelta
+
+
+def get_argument_parser(description):
+    parser = ArgumentParser(description=description)
+    parser.add_argument('--engine', choices=('sqlite', 'postgresql'), default='sqlite')
+    parser.add_argument('--name', default=None, help='Database name, SQLite uses in memory database by default.')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser
+
+
+def setup_django(engine='sqlite', name=None):
+    """
+    Configures Django with only the security application installed and creates its tables.
+    """
+    import django
+
+    from django.conf import settings
+    from django.core.management import call_command
+
+    if engine == 'postgresql':
+        database = {
+            'ENGINE': 'django.db.backends.postgresql_psycopg2',
+            'NAME': name or 'security_benchmark',
+            'USER': os.environ.get('PGUSER', ''),
+            'PASSWORD': os.environ.get('PGPASSWORD', ''),
+            'HOST': os.environ.get('PGHOST', ''),
+            'PORT': os.environ.get('PGPORT', ''),
+        }
+    else:
+        database = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': name or ':memory:'}
+
+    settings.configure(
+        DEBUG=False,
+        USE_TZ=True,
+        DATABASES={'default': database},
+        INSTALLED_APPS=('django.contrib.auth', 'django.contrib.contenttypes', 'security'),
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        MIDDLEWARE_CLASSES=(),
+        ROOT_URLCONF='benchmarks.urls',
+    )
+    if hasattr(django, 'setup'):
+        django.setup()
+
+    try:
+        call_command('syncdb', interactive=False, verbosity=0)
+    except Exception:
+        # syncdb command was removed in Django 1.9
+        call_command('migrate', run_syncdb=True, interactive=False, verbosity=0)
+
+
+def truncate_logged_requests():
+    from django.db import connection
+
+    from security.models import LoggedRequest
+
+    table = connection.ops.quote_name(LoggedRequest._meta.db_table)
+    cursor = connection.cursor()
+    if connection.vendor == 'postgresql':
+        cursor.execute('TRUNCATE %s' % table)
+    else:
+        cursor.execute('DELETE FROM %s' % table)
+
+
+def get_ips(count):
+    return ['10.%s.%s.%s' % ((i >> 16) & 255, (i >> 8) & 255, i & 255) for i in range(count)]
+
+
+def get_paths(count):
+    return ['/api/resource-%s/' % i for i in range(count)]
+
+
+def generate_logged_requests(rows, days=1, ips=1000, paths=100, batch_size=10000, seed=0):
+    """
+    Fills LoggedRequest table with synthetic requests uniformly spread over the last days.
+    """
+    from django.utils import timezone
+
+    from security.models import LoggedRequest
+
+    rand = random.Random(seed)
+    ips = get_ips(ips)
+    paths = get_paths(paths)
+    now = timezone.now()
+    period = days * 24 * 3600
+    types = (LoggedRequest.COMMON_REQUEST,) * 17 + (
+        LoggedRequest.THROTTLED_REQUEST, LoggedRequest.SUCCESSFUL_LOGIN_REQUEST,
+        LoggedRequest.UNSUCCESSFUL_LOGIN_REQUEST
+    )
+
+    batch = []
+    for i in range(rows):
+        request_timestamp = now - timedelta(seconds=rand.random() * period)
+        batch.append(LoggedRequest(
+            request_timestamp=request_timestamp, method=rand.choice(('GET', 'GET', 'GET', 'POST')),
+            path=rand.choice(paths), queries={}, headers={'USER_AGENT': 'benchmark'}, body='', is_secure=False,
+            response_timestamp=request_timestamp + timedelta(milliseconds=rand.randint(1, 500)), response_code=200,
+            status=LoggedRequest.FINE, type=rand.choice(types), ip=rand.choice(ips)
+        ))
+        if len(batch) == batch_size:
+            LoggedRequest.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        LoggedRequest.objects.bulk_create(batch)
+
+
+def measure(func, repeat):
+    """
+    Returns list of durations of the function calls in milliseconds.
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        durations.append((time.time() - start) * 1000)
+    return durations
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(percent / 100.0 * (len(values) - 1))))]
+
+
+def summarize(durations):
+    return {
+        'count': len(durations),
+        'p50_ms': percentile(durations, 50),
+        'p99_ms': percentile(durations, 99),
+        'max_ms': max(durations) if durations else None,
+    }
+
+
+def dump_results(results, stream=None):
+    import json
+
+    stream = stream or sys.stdout
+    json.dump(results, stream, indent=2, sort_keys=True)
+    stream.write('\n')
@@ -0,0 +1,245 @@
+"""
+Indexed archive of logged requests. Requests are stored in blocks, every block is a separate gzip member with NDJSON
+requests, therefore the data file is a valid gzip file. The binary index stored next to the data file contains
+offsets of the blocks with their time ranges and statuses and sorted lookup tables of IP addresses and paths which
+refer to the blocks containing them. Only the index is read (by mmap) to find the matching blocks.
+
+Index layout (little-endian):
+    header: magic, block count, IP address count, path count, offsets of the three sections
+    blocks: offset, compressed length, row count, min and max request timestamp (microseconds), status mask
+    IP address and path tables: key offset, key length, postings offset, postings count sorted by the key
+    followed by the keys and postings (uint32 block numbers)
+"""
+import calendar
+import json
+import mmap
+import struct
+import zlib
+
+from collections import defaultdict
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.encoding import force_bytes, force_text
+
+
+INDEX_MAGIC = b'SECIDX01'
+HEADER = struct.Struct('<8sIIIQQQ')
+BLOCK = struct.Struct('<QIIqqI')
+TABLE_ENTRY = struct.Struct('<QIQI')
+
+DEFAULT_BLOCK_SIZE = 1000
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def to_microseconds(value):
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value, timezone.get_default_timezone())
+    return calendar.timegm(value.utctimetuple()) * 1000000 + value.microsecond
+
+
+def compress_block(data):
+    # Window bits 16 + MAX_WBITS write the gzip member
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress_block(data):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+class ArchiveWriter(object):
+    """
+    Writes rows (dicts of LoggedRequest field values) to the data file, index is written by write_index.
+    """
+
+    def __init__(self, data_file, encoder_class, block_size=DEFAULT_BLOCK_SIZE):
+        self.data_file = data_file
+        self.encoder_class = encoder_class
+        self.block_size = block_size
+        self.blocks = []
+        self.ips = defaultdict(set)
+        self.paths = defaultdict(set)
+        self.offset = 0
+        self.rows = 0
+        self.size = 0
+        self._lines = []
+        self._min_timestamp = self._max_timestamp = None
+        self._status_mask = 0
+
+    def write(self, row):
+        line = force_bytes(json.dumps(row, cls=self.encoder_class, separators=(',', ':'))) + b'\n'
+        block_number = len(self.blocks)
+        timestamp = to_microseconds(row['request_timestamp'])
+        self._lines.append(line)
+        self._min_timestamp = timestamp if self._min_timestamp is None else min(self._min_timestamp, timestamp)
+        self._max_timestamp = timestamp if self._max_timestamp is None else max(self._max_timestamp, timestamp)
+        self._status_mask |= 1 << row['status']
+        self.ips[force_bytes(row['ip'])].add(block_number)
+        self.paths[force_bytes(row['path'])].add(block_number)
+        self.rows += 1
+        self.size += len(line)
+        if len(self._lines) >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        if not self._lines:
+            return
+
+        data = compress_block(b''.join(self._lines))
+        self.data_file.write(data)
+        self.blocks.append((self.offset, len(data), len(self._lines), self._min_timestamp, self._max_timestamp,
+                            self._status_mask))
+        self.offset += len(data)
+        self._lines = []
+        self._min_timestamp = self._max_timestamp = None
+        self._status_mask = 0
+
+    def _get_table(self, postings, start):
+        """
+        Returns table entries and data (keys and postings) of the table which starts at the start offset.
+        """
+        keys = sorted(postings)
+        data_offset = start + len(keys) * TABLE_ENTRY.size
+        entries = []
+        data = []
+        for key in keys:
+            block_numbers = sorted(postings[key])
+            encoded_postings = struct.pack('<%sI' % len(block_numbers), *block_numbers)
+            entries.append(TABLE_ENTRY.pack(data_offset, len(key), data_offset + len(key), len(block_numbers)))
+            data.extend((key, encoded_postings))
+            data_offset += len(key) + len(encoded_postings)
+        return b''.join(entries) + b''.join(data)
+
+    def write_index(self, index_file):
+        self.flush()
+        blocks_offset = HEADER.size
+        ips_offset = blocks_offset + len(self.blocks) * BLOCK.size
+        ips_table = self._get_table(self.ips, ips_offset)
+        paths_offset = ips_offset + len(ips_table)
+        index_file.write(HEADER.pack(INDEX_MAGIC, len(self.blocks), len(self.ips), len(self.paths), blocks_offset,
+                                     ips_offset, paths_offset))
+        for block in self.blocks:
+            index_file.write(BLOCK.pack(*block))
+        index_file.write(ips_table)
+        index_file.write(self._get_table(self.paths, paths_offset))
+
+
+class ArchiveIndex(object):
+    """
+    Memory mapped index of the archive, lookups read only the touched parts of the index.
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        with open(index_path, 'rb') as index_file:
+            self.mmap = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.block_count, self.ip_count, self.path_count, self.blocks_offset, self.ips_offset,
+         self.paths_offset) = HEADER.unpack_from(self.mmap, 0)
+        if magic != INDEX_MAGIC:
+            self.close()
+            raise ArchiveError('%s is not an archive index' % index_path)
+
+    def close(self):
+        self.mmap.close()
+
+    def get_block(self, block_number):
+        return BLOCK.unpack_from(self.mmap, self.blocks_offset + block_number * BLOCK.size)
+
+    def _get_entry(self, table_offset, i):
+        key_offset, key_length, postings_offset, postings_count = TABLE_ENTRY.unpack_from(
+            self.mmap, table_offset + i * TABLE_ENTRY.size
+        )
+        return self.mmap[key_offset:key_offset + key_length], postings_offset, postings_count
+
+    def _get_postings(self, postings_offset, postings_count):
+        return struct.unpack_from('<%sI' % postings_count, self.mmap, postings_offset)
+
+    def _lower_bound(self, table_offset, count, key):
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if self._get_entry(table_offset, middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find_ip(self, ip):
+        ip = force_bytes(ip)
+        i = self._lower_bound(self.ips_offset, self.ip_count, ip)
+        if i < self.ip_count:
+            key, postings_offset, postings_count = self._get_entry(self.ips_offset, i)
+            if key == ip:
+                return set(self._get_postings(postings_offset, postings_count))
+        return set()
+
+    def find_path_prefix(self, path_prefix):
+        """
+        Paths with the same prefix are adjacent in the sorted table.
+        """
+        path_prefix = force_bytes(path_prefix)
+        block_numbers = set()
+        for i in range(self._lower_bound(self.paths_offset, self.path_count, path_prefix), self.path_count):
+            key, postings_offset, postings_count = self._get_entry(self.paths_offset, i)
+            if not key.startswith(path_prefix):
+                break
+            block_numbers.update(self._get_postings(postings_offset, postings_count))
+        return block_numbers
+
+    def find_blocks(self, ip=None, path_prefix=None, statuses=None, start=None, end=None):
+        """
+        Returns sorted list of (block number, offset, compressed length) of blocks which can contain requests
+        matching all filters. Start and end are timestamps in microseconds.
+        """
+        block_numbers = None
+        if ip is not None:
+            block_numbers = self.find_ip(ip)
+        if path_prefix is not None and block_numbers != set():
+            path_block_numbers = self.find_path_prefix(path_prefix)
+            block_numbers = path_block_numbers if block_numbers is None else block_numbers & path_block_numbers
+        if block_numbers is None:
+            block_numbers = range(self.block_count)
+
+        status_mask = sum(1 << status for status in statuses) if statuses else None
+        blocks = []
+        for block_number in sorted(block_numbers):
+            offset, length, rows, min_timestamp, max_timestamp, block_status_mask = self.get_block(block_number)
+            if ((start is None or max_timestamp >= start) and (end is None or min_timestamp <= end) and
+                    (status_mask is None or block_status_mask & status_mask)):
+                blocks.append((block_number, offset, length))
+        return blocks
+
+
+def search_archive(data_path, index_path, ip=None, path_prefix=None, statuses=None, start=None, end=None):
+    """
+    Yields rows of the archive which match all filters, only blocks selected by the index are decompressed.
+    Start and end are datetimes.
+    """
+    start_us = to_microseconds(start) if start is not None else None
+    end_us = to_microseconds(end) if end is not None else None
+    index = ArchiveIndex(index_path)
+    try:
+        blocks = index.find_blocks(ip, path_prefix, statuses, start_us, end_us)
+    finally:
+        index.close()
+
+    with open(data_path, 'rb') as data_file:
+        for block_number, offset, length in blocks:
+            data_file.seek(offset)
+            for line in decompress_block(data_file.read(length)).splitlines():
+                row = json.loads(force_text(line))
+                if ip is not None and row['ip'] != ip:
+                    continue
+                if path_prefix is not None and not row['path'].startswith(path_prefix):
+                    continue
+                if statuses and row['status'] not in statuses:
+                    continue
+                if start_us is not None or end_us is not None:
+                    timestamp = to_microseconds(parse_datetime(row['request_timestamp']))
+                    if (start_us is not None and timestamp < start_us) or (end_us is not None and timestamp > end_us):
+                        continue
+                yield row
@@ -0,0 +1,271 @@
+import gzip
+import json
+import os
+import tempfile
+import time
+
+from collections import namedtuple
+from multiprocessing import Pool
+from datetime import datetime
+from datetime import time as datetime_time
+
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.utils.encoding import force_bytes, force_text
+from django.utils.timezone import utc
+
+from json_field.fields import JSONField
+
+from .models import LoggedRequest, RequestPayload
+from .archive import ArchiveWriter
+
+
+JSON_FORMAT = 'json'
+NDJSON_FORMAT = 'ndjson'
+INDEXED_FORMAT = 'indexed'
+
+BACKUP_EXTENSIONS = {
+    JSON_FORMAT: '.json.zip',
+    NDJSON_FORMAT: '.ndjson.zip',
+    INDEXED_FORMAT: '.ndjson.gz',
+}
+INDEX_EXTENSION = '.idx'
+
+
+class BackupJSONEncoder(DjangoJSONEncoder):
+    """
+    Keeps microseconds of datetimes, DjangoJSONEncoder truncates them to milliseconds.
+    """
+
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super(BackupJSONEncoder, self).default(o)
+
+
+BackupResult = namedtuple('BackupResult', ('path', 'rows', 'size', 'compressed_size', 'duration'))
+
+
+class CountingFile(object):
+    """
+    Counts bytes written to the wrapped file.
+    """
+
+    def __init__(self, file_out):
+        self.file_out = file_out
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        self.file_out.write(data)
+
+
+PAYLOAD_FIELDS = ('headers', 'queries')
+
+
+def get_backup_fields():
+    """
+    Deduplicated payloads are backed up in headers and queries fields.
+    """
+    return [field for field in LoggedRequest._meta.fields
+            if not field.primary_key and field.name not in ('%s_payload' % name for name in PAYLOAD_FIELDS)]
+
+
+def get_backup_file_path(directory, date, backup_format):
+    """
+    Returns path of the new backup file of the day, existing files are not overwritten.
+    """
+    log_file_path = os.path.abspath(os.path.join(directory, force_text(date)))
+    extension = BACKUP_EXTENSIONS[backup_format]
+    if os.path.isfile('%s%s' % (log_file_path, extension)):
+        i = 0
+        while os.path.isfile('%s(%s)%s' % (log_file_path, i, extension)):
+            i += 1
+        log_file_path = '%s(%s)' % (log_file_path, i)
+    return '%s%s' % (log_file_path, extension)
+
+
+def iterate_rows(qs, chunk_size=1000):
+    """
+    Yields requests of the queryset as dicts of field values. Rows are loaded in primary key chunks, therefore the
+    memory does not depend on the queryset size.
+    """
+    fields = get_backup_fields()
+    attnames = [field.attname for field in fields]
+    json_fields = [field for field in fields if isinstance(field, JSONField)]
+    payload_field = RequestPayload._meta.get_field('data')
+    payload_attnames = ['%s_payload__data' % name for name in PAYLOAD_FIELDS]
+    last_pk = None
+    while True:
+        chunk_qs = qs.order_by('pk')
+        if last_pk is not None:
+            chunk_qs = chunk_qs.filter(pk__gt=last_pk)
+        rows = list(chunk_qs.values('pk', *(attnames + payload_attnames))[:chunk_size])
+        if not rows:
+            return
+
+        last_pk = rows[-1]['pk']
+        for row in rows:
+            del row['pk']
+            for field in json_fields:
+                # values() returns JSON fields as serialized strings
+                row[field.attname] = field.to_python(row[field.attname])
+            for name, payload_attname in zip(PAYLOAD_FIELDS, payload_attnames):
+                payload = row.pop(payload_attname)
+                if payload is not None:
+                    row[name] = payload_field.to_python(payload)
+            yield row
+
+
+def write_ndjson(rows, file_out):
+    """
+    Writes one compact JSON object per line, returns count of written rows.
+    """
+    count = 0
+    for row in rows:
+        file_out.write(force_bytes(json.dumps(row, cls=BackupJSONEncoder, separators=(',', ':'))))
+        file_out.write(b'\n')
+        count += 1
+    return count
+
+
+def write_json(qs, file_out):
+    """
+    Writes requests serialized by django python serializer, whole day is loaded to the memory.
+    """
+    logged_requests = []
+    for logged_request in qs.select_related(*('%s_payload' % name for name in PAYLOAD_FIELDS)):
+        logged_request.resolve_payloads()
+        logged_requests.append(logged_request)
+    data = serializers.serialize('python', logged_requests, fields=[field.name for field in get_backup_fields()])
+    for obj_data in data:
+        del obj_data['pk']
+    file_out.write(force_bytes(json.dumps(data, cls=DjangoJSONEncoder, indent=5)))
+    return len(data)
+
+
+def get_index_file_path(file_path):
+    return '%s%s' % (file_path[:-len(BACKUP_EXTENSIONS[INDEXED_FORMAT])], INDEX_EXTENSION)
+
+
+def write_indexed(rows, data_file, index_file):
+    """
+    Writes rows in gzip blocks and their index, returns count of written rows and their uncompressed size.
+    """
+    writer = ArchiveWriter(data_file, BackupJSONEncoder)
+    for row in rows:
+        writer.write(row)
+    writer.write_index(index_file)
+    return writer.rows, writer.size
+
+
+def _backup_indexed_day(qs, date, directory):
+    fd, tmp_file_path = tempfile.mkstemp(prefix='.%s' % date, suffix='.tmp', dir=directory)
+    os.close(fd)
+    fd, tmp_index_path = tempfile.mkstemp(prefix='.%s' % date, suffix='.idx.tmp', dir=directory)
+    os.close(fd)
+    try:
+        with open(tmp_file_path, 'wb') as data_file, open(tmp_index_path, 'wb') as index_file:
+            rows, size = write_indexed(iterate_rows(qs), data_file, index_file)
+        file_path = get_backup_file_path(directory, date, INDEXED_FORMAT)
+        # Index is renamed first, data file without index is not considered complete
+        os.rename(tmp_index_path, get_index_file_path(file_path))
+        os.rename(tmp_file_path, file_path)
+    except Exception:
+        for path in (tmp_file_path, tmp_index_path):
+            if os.path.isfile(path):
+                os.remove(path)
+        raise
+    return file_path, rows, size
+
+
+def backup_day(query, date, directory, backup_format):
+    """
+    Writes requests of the query from the day to a temporary file which is renamed to the backup file when it is
+    complete. Query is passed instead of the queryset because the function is called in worker processes.
+    """
+    start = time.time()
+    qs = LoggedRequest.objects.all()
+    qs.query = query
+    qs = qs.filter(request_timestamp__range=(datetime.combine(date, datetime_time.min).replace(tzinfo=utc),
+                                             datetime.combine(date, datetime_time.max).replace(tzinfo=utc)))
+
+    if backup_format == INDEXED_FORMAT:
+        file_path, rows, size = _backup_indexed_day(qs, date, directory)
+        return BackupResult(file_path, rows, size, os.path.getsize(file_path), time.time() - start)
+
+    fd, tmp_file_path = tempfile.mkstemp(prefix='.%s' % date, suffix='.tmp', dir=directory)
+    os.close(fd)
+    try:
+        with gzip.open(tmp_file_path, 'wb') as gzip_file:
+            file_out = CountingFile(gzip_file)
+            if backup_format == NDJSON_FORMAT:
+                rows = write_ndjson(iterate_rows(qs), file_out)
+            else:
+                rows = write_json(qs, file_out)
+        file_path = get_backup_file_path(directory, date, backup_format)
+        os.rename(tmp_file_path, file_path)
+    except Exception:
+        os.remove(tmp_file_path)
+        raise
+    return BackupResult(file_path, rows, file_out.size, os.path.getsize(file_path), time.time() - start)
+
+
+def _backup_day_worker(args):
+    return backup_day(*args)
+
+
+def is_in_memory_database(connection):
+    name = connection.settings_dict['NAME']
+    return connection.vendor == 'sqlite' and (not name or name == ':memory:' or 'mode=memory' in name)
+
+
+def backup_days(qs, directory, backup_format, workers=1):
+    """
+    Backups every day of the queryset to a separate file, days are processed by the pool of worker processes.
+    Yields BackupResult of every day when it is finished. In-memory SQLite database exists only in its connection,
+    therefore it is always backed up by the current process.
+    """
+    tasks = [(qs.query, timestamp.date(), directory, backup_format)
+             for timestamp in qs.datetimes('request_timestamp', 'day')]
+    if workers <= 1 or any(is_in_memory_database(connection) for connection in connections.all()):
+        for task in tasks:
+            yield backup_day(*task)
+    else:
+        # Forked workers must not share database connections with the parent process
+        for connection in connections.all():
+            connection.close()
+        pool = Pool(workers)
+        try:
+            for result in pool.imap_unordered(_backup_day_worker, tasks):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+
+
+def read_backup(file_path):
+    """
+    Yields field values of requests stored in the backup file of any format.
+    """
+    with gzip.open(file_path, 'rb') as file_in:
+        if file_path.endswith((BACKUP_EXTENSIONS[NDJSON_FORMAT], BACKUP_EXTENSIONS[INDEXED_FORMAT])):
+            for line in file_in:
+                if line.strip():
+                    yield json.loads(force_text(line))
+        else:
+            # Serialized by django python serializer, whole file must be loaded
+            for obj_data in json.loads(force_text(file_in.read())):
+                yield dict((LoggedRequest._meta.get_field(name).attname, value)
+                           for name, value in obj_data['fields'].items())
+
+
+def row_to_logged_request(row):
+    return LoggedRequest(**dict(
+        (field.attname, field.to_python(row[field.attname])) for field in get_backup_fields() if field.attname in row
+    ))
+
+
+def logged_request_to_row(logged_request):
+    return dict((field.attname, getattr(logged_request, field.attname)) for field in get_backup_fields())
@@ -0,0 +1,153 @@
+import hashlib
+import threading
+import time
+
+from datetime import datetime
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.encoding import force_bytes, force_text
+from django.utils.translation import ugettext
+
+from .models import LoggedRequest
+from .config import THROTTLING_BAN_SCOPE, THROTTLING_CACHE_NAME
+from .utils import get_cache, get_request_info
+
+
+def from_timestamp(timestamp):
+    value = datetime.fromtimestamp(timestamp, timezone.utc)
+    return value if settings.USE_TZ else timezone.make_naive(value, timezone.get_default_timezone())
+
+
+class Ban(object):
+    """
+    Throttled client with the pre-rendered throttling response and the count of suppressed requests.
+    """
+
+    def __init__(self, ip, path, method, description, start, expires, content, content_type, status_code):
+        self.ip = ip
+        self.path = path
+        self.method = method
+        self.description = description
+        self.start = start
+        self.expires = expires
+        self.content = content
+        self.content_type = content_type
+        self.status_code = status_code
+        self.suppressed = 0
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in (
+            'ip', 'path', 'method', 'description', 'start', 'expires', 'content', 'content_type', 'status_code'
+        ))
+
+    def get_response(self):
+        response = HttpResponse(self.content, content_type=self.content_type)
+        response.status_code = self.status_code
+        return response
+
+    def to_logged_request(self):
+        """
+        Returns one throttled request which represents all suppressed requests.
+        """
+        return LoggedRequest(
+            request_timestamp=from_timestamp(self.start), method=self.method, path=self.path,
+            body='', response_timestamp=from_timestamp(self.expires),
+            response_code=self.status_code, status=LoggedRequest.WARNING, type=LoggedRequest.THROTTLED_REQUEST,
+            error_description=(ugettext('%(count)s requests suppressed: %(description)s') % {
+                'count': self.suppressed, 'description': self.description
+            })[:255],
+            sample_weight=self.suppressed, ip=self.ip
+        )
+
+
+class BanList(object):
+    """
+    Throttled clients are banned until the validator cannot be passed. Bans are kept in the process memory and
+    shared with other processes through the cache, banned requests are answered with the pre-rendered response
+    without any database access. Requests are banned by IP address and path or by IP address only (scope).
+    """
+
+    IP = 'ip'
+    IP_PATH = 'ip_path'
+
+    key_prefix = 'security:ban'
+
+    def __init__(self, scope=THROTTLING_BAN_SCOPE, cache_name=THROTTLING_CACHE_NAME):
+        assert scope in (self.IP, self.IP_PATH), 'Unknown ban scope %s' % scope
+
+        self.scope = scope
+        self.cache = get_cache(cache_name)
+        self._bans = {}
+        self._next_expiry = None
+        self._lock = threading.Lock()
+
+    def get_key(self, request):
+        request_info = get_request_info(request)
+        return (request_info.ip,) if self.scope == self.IP else (request_info.ip, request_info.path)
+
+    def get_cache_key(self, key):
+        return '%s:%s' % (self.key_prefix, hashlib.md5(force_bytes('|'.join(key))).hexdigest())
+
+    def _add(self, key, ban):
+        with self._lock:
+            self._bans[key] = ban
+            if self._next_expiry is None or ban.expires < self._next_expiry:
+                self._next_expiry = ban.expires
+
+    def ban(self, request, validator, response):
+        """
+        Bans the client throttled by the validator, the response is returned to all banned requests.
+        """
+        timeout = validator.get_ban_timeout()
+        if timeout <= 0 or getattr(response, 'streaming', False):
+            return
+
+        if not getattr(response, 'is_rendered', True):
+            response.render()
+        request_info = get_request_info(request)
+        now = time.time()
+        key = self.get_key(request)
+        ban = Ban(request_info.ip, request_info.path, request_info.method, force_text(validator.description), now,
+                  now + timeout, response.content, response['Content-Type'], response.status_code)
+        self._add(key, ban)
+        self.cache.set(self.get_cache_key(key), ban.to_dict(), int(timeout) + 1)
+
+    def get_local(self, key, now):
+        ban = self._bans.get(key)
+        return ban if ban is not None and ban.expires > now else None
+
+    def add_cached(self, key, value, now):
+        """
+        Adds ban loaded from the cache to the process memory.
+        """
+        if value and value['expires'] > now:
+            ban = Ban(**value)
+            self._add(key, ban)
+            return ban
+        return None
+
+    def get_ban(self, request):
+        now = time.time()
+        key = self.get_key(request)
+        return self.get_local(key, now) or self.add_cached(key, self.cache.get(self.get_cache_key(key)), now)
+
+    def suppress(self, ban):
+        with self._lock:
+            ban.suppressed += 1
+        return ban.get_response()
+
+    def pop_expired(self):
+        """
+        Returns expired bans with suppressed requests, every ban is returned once.
+        """
+        now = time.time()
+        if self._next_expiry is None or self._next_expiry > now:
+            return []
+
+        with self._lock:
+            expired = [key for key, ban in self._bans.items() if ban.expires <= now]
+            bans = [self._bans.pop(key) for key in expired]
+            self._next_expiry = min(ban.expires for ban in self._bans.values()) if self._bans else None
+        return [ban for ban in bans if ban.suppressed]
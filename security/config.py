@@ -5,3 +5,27 @@ DEFAULT_THROTTLING_VALIDATORS = getattr(settings, 'DEFAULT_THROTTLING_VALIDATORS
 THROTTLING_FAILURE_VIEW = getattr(settings, 'THROTTLING_FAILURE_VIEW', 'security.views.throttling_failure_view')
 LOG_IGNORE_IP = getattr(settings, 'LOG_IGNORE_IP', tuple())
 LOG_REQUEST_BODY_LENGTH = getattr(settings, 'LOG_REQUEST_BODY_LENGTH', 500)
+# Counter backend of the log storage is used by default
+THROTTLING_COUNTER_BACKEND = getattr(settings, 'THROTTLING_COUNTER_BACKEND', None)
+THROTTLING_CACHE_NAME = getattr(settings, 'THROTTLING_CACHE_NAME', 'default')
+LOG_WRITE_BEHIND = getattr(settings, 'LOG_WRITE_BEHIND', False)
+LOG_WRITE_BEHIND_QUEUE_SIZE = getattr(settings, 'LOG_WRITE_BEHIND_QUEUE_SIZE', 10000)
+LOG_WRITE_BEHIND_BATCH_SIZE = getattr(settings, 'LOG_WRITE_BEHIND_BATCH_SIZE', 500)
+LOG_WRITE_BEHIND_FLUSH_INTERVAL = getattr(settings, 'LOG_WRITE_BEHIND_FLUSH_INTERVAL', 1)
+LOG_WRITE_BEHIND_OVERFLOW = getattr(settings, 'LOG_WRITE_BEHIND_OVERFLOW', 'block')
+LOG_WRITE_BEHIND_OVERFLOW_SAMPLE_RATE = getattr(settings, 'LOG_WRITE_BEHIND_OVERFLOW_SAMPLE_RATE', 0.1)
+LOG_PARTITIONING = getattr(settings, 'LOG_PARTITIONING', None)
+LOG_PARTITIONS_AHEAD = getattr(settings, 'LOG_PARTITIONS_AHEAD', 7)
+LOG_SAMPLING = getattr(settings, 'LOG_SAMPLING', {})
+LOG_ROLLUPS = getattr(settings, 'LOG_ROLLUPS', False)
+LOG_LIST_EXACT_COUNT_LIMIT = getattr(settings, 'LOG_LIST_EXACT_COUNT_LIMIT', 100000)
+THROTTLING_BAN = getattr(settings, 'THROTTLING_BAN', False)
+THROTTLING_BAN_SCOPE = getattr(settings, 'THROTTLING_BAN_SCOPE', 'ip_path')
+LOG_STORAGE = getattr(settings, 'LOG_STORAGE', 'security.storage.ModelLogStorage')
+LOG_STORAGE_OPTIONS = getattr(settings, 'LOG_STORAGE_OPTIONS', {})
+LOG_DATABASE = getattr(settings, 'LOG_DATABASE', 'default')
+THROTTLING_DATABASE = getattr(settings, 'THROTTLING_DATABASE', None)
+THROTTLING_DATABASE_MAX_LAG = getattr(settings, 'THROTTLING_DATABASE_MAX_LAG', None)
+LOG_HEADERS_ALLOWLIST = getattr(settings, 'LOG_HEADERS_ALLOWLIST', None)
+LOG_HEADERS_DENYLIST = getattr(settings, 'LOG_HEADERS_DENYLIST', ())
+LOG_PAYLOAD_DEDUPLICATION = getattr(settings, 'LOG_PAYLOAD_DEDUPLICATION', False)
@@ -1,6 +1,7 @@
 from __future__ import unicode_literals
 
 from is_core.main import UIRestModelISCore
+from django.db import router
 from django.utils.translation import ugettext_lazy as _
 
 from security.models import LoggedRequest
@@ -14,14 +15,38 @@ class RequestsLogIsCore(UIRestModelISCore):
     )
 
     form_fieldsets = (
-        (_('Request'), {'fields': ('request_timestamp', 'method', 'path', 'queries', 'headers', 'body', 'is_secure')}),
+        (_('Request'), {'fields': ('request_timestamp', 'method', 'path', 'queries_data', 'headers_data', 'body',
+                                   'is_secure')}),
         (_('Response'), {'fields': ('response_timestamp', 'response_code', 'status', 'type', 'error_description')}),
         (_('User information'), {'fields': ('user', 'ip')}),
         (_('Extra information'), {'fields': ('response_time',)})
     )
 
+    # Large columns and payload references which are not listed, the detail loads them on access
+    deferred_fields = ('queries', 'headers', 'body', 'queries_payload', 'headers_payload')
+
     abstract = True
 
+    def get_queryset(self, request):
+        """
+        Listing of millions of requests is kept fast by deferring the large columns, joining users up front (if
+        they are stored in the same database) and by the estimated count. Requests which follow the request with id
+        passed in the "after" query parameter are returned with keyset pagination, the page is not slowed down by
+        the offset. The list pages use offsets, "after" is used only by clients which pass it explicitly.
+        """
+        qs = super(RequestsLogIsCore, self).get_queryset(request).defer(*self.deferred_fields).with_estimated_count()
+        user_model = LoggedRequest._meta.get_field('user').rel.to
+        if router.db_for_read(LoggedRequest) == router.db_for_read(user_model):
+            qs = qs.select_related('user')
+        after = request.GET.get('after')
+        if after:
+            try:
+                request_timestamp = LoggedRequest.objects.values_list('request_timestamp', flat=True).get(pk=after)
+            except (LoggedRequest.DoesNotExist, ValueError):
+                return qs.none()
+            qs = qs.after(request_timestamp, after)
+        return qs
+
     def has_create_permission(self, request, obj=None):
         return False
 
@@ -0,0 +1,196 @@
+import hashlib
+import time
+
+from datetime import timedelta
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.urlresolvers import get_callable
+from django.db.models import F, Sum
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+
+from .models import LoggedRequest, LoggedRequestRollup
+from .config import THROTTLING_COUNTER_BACKEND, THROTTLING_CACHE_NAME, LOG_WRITE_BEHIND, LOG_ROLLUPS
+from .utils import get_cache
+from .writebehind import get_logged_request_writer
+from .storage import get_log_storage
+from .routers import get_throttling_database
+
+
+try:
+    from django.db.models import Case, When
+except ImportError:
+    # Conditional expressions are available since Django 1.8
+    Case = When = None
+
+
+class CounterBackend(object):
+    """
+    Counts logged requests with the same IP address and path inside a timeframe.
+    """
+
+    def register(self, timeframe, field):
+        """
+        Is called by validators to announce which timeframe and which field (method or type) they will count.
+        """
+        pass
+
+    def increment(self, logged_request, count=1):
+        """
+        Is called for every logged request after it was stored, count is the number of requests which the logged
+        request represents.
+        """
+        pass
+
+    def count(self, timeframe, ip, path, **filters):
+        raise NotImplementedError
+
+    def count_many(self, ip, path, counters):
+        """
+        Returns list of counts for the list of counters (timeframe, field, value) with the same IP address and path.
+        """
+        return [self.count(timeframe, ip, path, **{field: value}) for timeframe, field, value in counters]
+
+
+class DatabaseCounterBackend(CounterBackend):
+    """
+    Counts stored LoggedRequest rows, every count is one database query. Sampled rows are counted by their weight.
+    With LOG_WRITE_BEHIND the requests queued in the current process but not stored yet are counted too. Rows are
+    counted in THROTTLING_DATABASE if it is set.
+    """
+
+    def _count_pending(self, timeframe, ip, path, **filters):
+        if not LOG_WRITE_BEHIND:
+            return 0
+        return get_logged_request_writer().count_pending(timeframe, ip, path, **filters)
+
+    def count(self, timeframe, ip, path, **filters):
+        count = LoggedRequest.objects.using(get_throttling_database(LoggedRequest)).filter(
+            ip=ip, path=path, request_timestamp__gte=timezone.now() - timedelta(seconds=timeframe), **filters
+        ).aggregate(count=Sum('sample_weight'))['count']
+        return (count or 0) + self._count_pending(timeframe, ip, path, **filters)
+
+    def count_many(self, ip, path, counters):
+        """
+        All counts are computed with one query by conditional aggregates limited by the largest timeframe.
+        """
+        if Case is None or len(counters) < 2:
+            return super(DatabaseCounterBackend, self).count_many(ip, path, counters)
+
+        now = timezone.now()
+        aggregates = dict(
+            ('count_%s' % i, Sum(Case(When(then=F('sample_weight'), **{
+                'request_timestamp__gte': now - timedelta(seconds=timeframe), field: value
+            })))) for i, (timeframe, field, value) in enumerate(counters)
+        )
+        max_timeframe = max(timeframe for timeframe, _, _ in counters)
+        counts = LoggedRequest.objects.using(get_throttling_database(LoggedRequest)).filter(
+            ip=ip, path=path, request_timestamp__gte=now - timedelta(seconds=max_timeframe)
+        ).aggregate(**aggregates)
+        return [(counts['count_%s' % i] or 0) + self._count_pending(timeframe, ip, path, **{field: value})
+                for i, (timeframe, field, value) in enumerate(counters)]
+
+
+class CacheCounterBackend(CounterBackend):
+    """
+    Sliding window counters stored in the Django cache. The window is approximated by the counter of the current
+    fixed window and the proportional part of the previous one, therefore increment and count are O(1).
+    """
+
+    key_prefix = 'security:counter'
+
+    def __init__(self):
+        self.cache = get_cache(THROTTLING_CACHE_NAME)
+        self.counted_fields = set()
+
+    def register(self, timeframe, field):
+        self.counted_fields.add((timeframe, field))
+
+    def _get_key(self, timeframe, window, ip, path, field, value):
+        digest = hashlib.md5(force_bytes('%s|%s|%s|%s' % (ip, path, field, value))).hexdigest()
+        return '%s:%s:%s:%s' % (self.key_prefix, timeframe, window, digest)
+
+    def _incr(self, key, timeout, count):
+        if not self.cache.add(key, count, timeout):
+            try:
+                self.cache.incr(key, count)
+            except ValueError:
+                # Key expired between add and incr
+                self.cache.set(key, count, timeout)
+
+    def increment(self, logged_request, count=1):
+        now = time.time()
+        for timeframe, field in self.counted_fields:
+            window = int(now // timeframe)
+            key = self._get_key(timeframe, window, logged_request.ip, logged_request.path, field,
+                                getattr(logged_request, field))
+            self._incr(key, 2 * timeframe, count)
+
+    def count(self, timeframe, ip, path, **filters):
+        (field, value), = filters.items()
+        return self.count_many(ip, path, [(timeframe, field, value)])[0]
+
+    def count_many(self, ip, path, counters):
+        """
+        Counters of all windows are loaded by one get_many call.
+        """
+        now = time.time()
+        keys = []
+        for timeframe, field, value in counters:
+            window = int(now // timeframe)
+            keys.append((self._get_key(timeframe, window, ip, path, field, value),
+                         self._get_key(timeframe, window - 1, ip, path, field, value),
+                         1 - (now - window * timeframe) / float(timeframe)))
+        counts = self.cache.get_many([key for current_key, previous_key, _ in keys
+                                      for key in (current_key, previous_key)])
+        return [counts.get(current_key, 0) + int(counts.get(previous_key, 0) * previous_weight)
+                for current_key, previous_key, previous_weight in keys]
+
+
+class RollupCounterBackend(CounterBackend):
+    """
+    Counts requests from per-minute LoggedRequestRollup buckets (LOG_ROLLUPS setting), all windows are answered by
+    one query which sums at most timeframe / 60 buckets per method and type. Windows are aligned to whole minutes.
+    With LOG_WRITE_BEHIND the increments queued in the current process but not stored yet are counted too.
+    """
+
+    def __init__(self):
+        if not LOG_ROLLUPS:
+            raise ImproperlyConfigured('RollupCounterBackend requires LOG_ROLLUPS setting')
+
+    def _get_window_start(self, now, timeframe):
+        return (now - timedelta(seconds=timeframe)).replace(second=0, microsecond=0)
+
+    def count(self, timeframe, ip, path, **filters):
+        (field, value), = filters.items()
+        return self.count_many(ip, path, [(timeframe, field, value)])[0]
+
+    def count_many(self, ip, path, counters):
+        now = timezone.now()
+        max_timeframe = max(timeframe for timeframe, _, _ in counters)
+        buckets = list(LoggedRequestRollup.objects.using(get_throttling_database(LoggedRequestRollup)).filter(
+            ip=ip, path=path, minute__gte=self._get_window_start(now, max_timeframe)
+        ).order_by().values('minute', 'method', 'type', 'count'))
+        if LOG_WRITE_BEHIND:
+            buckets += [
+                dict(minute=minute, method=method, type=type, count=count)
+                for minute, method, type, count in get_logged_request_writer().count_pending_rollups(
+                    ip, path, self._get_window_start(now, max_timeframe)
+                )
+            ]
+        counts = []
+        for timeframe, field, value in counters:
+            window_start = self._get_window_start(now, timeframe)
+            counts.append(sum(bucket['count'] for bucket in buckets
+                              if bucket['minute'] >= window_start and bucket[field] == value))
+        return counts
+
+
+_counter_backend = None
+
+
+def get_counter_backend():
+    global _counter_backend
+    if _counter_backend is None:
+        _counter_backend = get_callable(THROTTLING_COUNTER_BACKEND or get_log_storage().counter_backend)()
+    return _counter_backend
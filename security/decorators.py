@@ -5,13 +5,18 @@ from django.utils.decorators import available_attrs
 
 def throttling(validator):
     """
-    Adds throttling validator to a function.
+    Adds throttling validator to a function. Validators are evaluated by LogMiddleware together with the default
+    validators, the function validates the validator only if it was not validated by the middleware (e.g. methods
+    of class based views whose validators are not copied to the view by as_view).
     """
     def decorator(view_func):
         def _throttling(self, request, *args, **kwargs):
-            validator.validate(request)
+            if validator not in getattr(request, '_throttling_validated', ()):
+                validator.validate(request)
             return view_func(self, request, *args, **kwargs)
-        return wraps(view_func, assigned=available_attrs(view_func))(_throttling)
+        wrapper = wraps(view_func, assigned=available_attrs(view_func))(_throttling)
+        wrapper.throttling_validators = tuple(getattr(view_func, 'throttling_validators', ())) + (validator,)
+        return wrapper
 
     return decorator
 
@@ -82,3 +87,22 @@ def log_exempt_all(klass):
     dispatch = getattr(klass, 'dispatch')
     setattr(klass, 'dispatch', log_exempt()(dispatch))
     return klass
+
+
+def log_sampling(rate):
+    """
+    Stores only the rate fraction of successful common requests of a function.
+    """
+    return add_attribute_wrapper('log_sample_rate', rate)
+
+
+def log_sampling_all(rate):
+    """
+    Stores only the rate fraction of successful common requests of a class.
+    """
+    def decorator(klass):
+        dispatch = getattr(klass, 'dispatch')
+        setattr(klass, 'dispatch', log_sampling(rate)(dispatch))
+        return klass
+
+    return decorator
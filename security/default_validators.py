@@ -1,4 +1,6 @@
-from .throttling import PerRequestThrottlingValidator, UnsuccessfulLoginThrottlingValidator, SuccessfulLoginThrottlingValidator
+from .throttling import (PerRequestThrottlingValidator, UnsuccessfulLoginThrottlingValidator,
+                         SuccessfulLoginThrottlingValidator, GCRAThrottlingValidator,
+                         HeavyHitterThrottlingValidator)
 
 
 validators = (
@@ -8,4 +10,8 @@ validators = (
     UnsuccessfulLoginThrottlingValidator(10 * 60, 10),
     SuccessfulLoginThrottlingValidator(60, 2),
     SuccessfulLoginThrottlingValidator(10 * 60, 10),
-)
\ No newline at end of file
+    # Cache based alternative of PerRequestThrottlingValidator which does not count logged requests
+    # GCRAThrottlingValidator(3600, 1000),  # 1000 per an hour
+    # Requests of an IP address to all paths counted by the count-min sketch
+    # HeavyHitterThrottlingValidator(60, 600),  # 600 per an minute
+)
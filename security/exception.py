@@ -1,2 +1,5 @@
 class ThrottlingException(Exception):
-    pass
\ No newline at end of file
+
+    def __init__(self, description, validator=None):
+        super(ThrottlingException, self).__init__(description)
+        self.validator = validator
@@ -0,0 +1,36 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction, router
+
+from security.models import LoggedRequest
+from security.config import LOG_PARTITIONING, LOG_PARTITIONS_AHEAD
+from security.partitions import PERIODS, PartitioningError, setup_partitioning, create_partitions, is_partitioned
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--setup', action='store_true', dest='setup', default=False,
+            help='Converts the logged requests table to the partitioned table.'),
+        make_option('--ahead', action='store', dest='ahead', type='int', default=LOG_PARTITIONS_AHEAD,
+            help='Number of periods which partitions are created ahead.'),
+    )
+    help = 'Creates partitions of the logged requests table for the upcoming periods (LOG_PARTITIONING setting).'
+
+    def handle(self, **options):
+        if LOG_PARTITIONING not in PERIODS:
+            raise CommandError('LOG_PARTITIONING must be one of %s' % ', '.join(PERIODS))
+
+        try:
+            with transaction.atomic(using=router.db_for_write(LoggedRequest)):
+                if options.get('setup'):
+                    partition = setup_partitioning()
+                    self.stdout.write('Existing requests were attached as partition %s' % partition.name)
+                elif not is_partitioned():
+                    raise CommandError('Table is not partitioned, run the command with --setup option')
+
+                for partition in create_partitions(ahead=options.get('ahead')):
+                    self.stdout.write('Created partition %s (%s - %s)' % (partition.name, partition.start,
+                                                                          partition.end))
+        except PartitioningError as ex:
+            raise CommandError(ex)
@@ -0,0 +1,49 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.encoding import force_text
+
+from security.models import LoggedRequest
+from security.backup import read_backup, row_to_logged_request
+from security.config import LOG_PAYLOAD_DEDUPLICATION
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', action='store', dest='batch_size', type='int', default=1000,
+            help='Number of requests stored by one query.'),
+    )
+    help = 'Loads requests from backup files created by purgeloggedrequests command.'
+    args = '<backup file backup file ...>'
+
+    def store_batch(self, batch):
+        if LOG_PAYLOAD_DEDUPLICATION:
+            LoggedRequest.objects.deduplicate_and_store(batch, LoggedRequest.objects.bulk_create)
+        else:
+            LoggedRequest.objects.bulk_create(batch)
+
+    def load_file(self, file_path, batch_size):
+        count = 0
+        batch = []
+        for row in read_backup(file_path):
+            batch.append(row_to_logged_request(row))
+            if len(batch) == batch_size:
+                self.store_batch(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            self.store_batch(batch)
+            count += len(batch)
+        return count
+
+    def handle(self, *file_paths, **options):
+        if not file_paths:
+            raise CommandError('Enter at least one backup file')
+
+        for file_path in file_paths:
+            try:
+                count = self.load_file(file_path, options.get('batch_size'))
+            except (IOError, ValueError) as ex:
+                self.stderr.write(force_text(ex))
+            else:
+                self.stdout.write('Loaded %d requests from %s' % (count, file_path))
@@ -1,19 +1,22 @@
 import json
 import os
-import gzip
+import time as time_module
 
-from datetime import timedelta, datetime, time
+from datetime import timedelta
 
 from optparse import make_option
 
 from django.core.management.base import BaseCommand
 from django.utils import timezone
-from django.core import serializers
 from django.core.serializers.json import DjangoJSONEncoder
-from django.utils.timezone import utc
 from django.utils.encoding import force_text
+from django.utils.dateparse import parse_datetime
 
-from security.models import LoggedRequest
+from security.models import LoggedRequest, LoggedRequestRollup, RequestPayload
+from security.backup import JSON_FORMAT, NDJSON_FORMAT, INDEXED_FORMAT, backup_days
+from security.config import LOG_PARTITIONING, LOG_PAYLOAD_DEDUPLICATION
+from security.partitions import is_partitioned, drop_partitions
+from security.storage import ModelLogStorage, get_log_storage
 
 
 DURATION_OPTIONS = {
@@ -30,36 +33,104 @@ class Command(BaseCommand):
             help='Tells Django to NOT prompt the user for input of any kind.'),
         make_option('--backup', action='store', dest='backup', default=False,
             help='Tells Django where to backup removing requests.'),
+        make_option('--backup-format', action='store', dest='backup_format', type='choice',
+            choices=(JSON_FORMAT, NDJSON_FORMAT, INDEXED_FORMAT), default=JSON_FORMAT,
+            help='Backup format, ndjson is streamed with one request per line, indexed is ndjson in blocks with '
+                 'the index for searchloggedrequests command.'),
+        make_option('--workers', action='store', dest='workers', type='int', default=1,
+            help='Number of processes which backup days in parallel.'),
+        make_option('--batch-size', action='store', dest='batch_size', type='int', default=None,
+            help='Removes requests in batches of the given size instead of one delete query.'),
+        make_option('--chunk-by', action='store', dest='chunk_by', type='choice', choices=('pk', 'timestamp'),
+            default='pk', help='Batches are ranges of primary keys (pk) or request timestamps (timestamp).'),
+        make_option('--sleep', action='store', dest='sleep', type='float', default=0,
+            help='Seconds to sleep between batches.'),
+        make_option('--max-runtime', action='store', dest='max_runtime', type='float', default=None,
+            help='Stops removing batches after the given number of seconds.'),
+        make_option('--rollups', action='store_true', dest='rollups', default=False,
+            help='Removes request rollups instead of logged requests, rollups can be kept longer than requests.'),
+        make_option('--watermark-file', action='store', dest='watermark_file', default=None,
+            help='File with the last removed batch watermark, purge resumes from it.'),
     )
     help = ""
     args = '[amount duration]'
 
-    def serialize(self, qs):
-        data = serializers.serialize('python', qs)
-
-        for obj_data in data:
-            del obj_data['pk']
-        return data
-
-    def backup_to_file(self, qs, path):
+    def backup_to_file(self, qs, path, backup_format=JSON_FORMAT, workers=1):
         self.stdout.write('Backup old requests')
 
-        for timestamp in qs.datetimes('request_timestamp', 'day'):
-            min_timestamp = datetime.combine(timestamp, time.min).replace(tzinfo=utc)
-            max_timestamp = datetime.combine(timestamp, time.max).replace(tzinfo=utc)
-            file_qs = qs.filter(request_timestamp__range=(min_timestamp, max_timestamp))
-
-            log_file_path = os.path.abspath(os.path.join(path, force_text(timestamp.date())))
-
-            if os.path.isfile('%s.json.zip' % log_file_path):
-                i = 0
-                while os.path.isfile('%s(%s).json.zip' % (log_file_path, i)):
-                    i += 1
-                log_file_path = '%s(%s)' % (log_file_path, i)
-
-            self.stdout.write(4 * ' ' + log_file_path)
-            with gzip.open('%s.json.zip' % log_file_path, 'wb') as file_out:
-                file_out.writelines(json.dumps(self.serialize(file_qs), cls=DjangoJSONEncoder, indent=5))
+        start = time_module.time()
+        rows = size = compressed_size = 0
+        for result in backup_days(qs, path, backup_format, workers):
+            self.stdout.write(4 * ' ' + result.path)
+            rows += result.rows
+            size += result.size
+            compressed_size += result.compressed_size
+
+        elapsed = max(time_module.time() - start, 0.001)
+        self.stdout.write('Backed up %d requests, %d bytes written (%d bytes uncompressed) in %.1f s (%.2f MB/s)' % (
+            rows, compressed_size, size, elapsed, size / elapsed / 1024 / 1024))
+
+    def load_watermark(self, watermark_file, chunk_by):
+        if not watermark_file or not os.path.isfile(watermark_file):
+            return None
+
+        with open(watermark_file) as file_in:
+            data = json.load(file_in)
+        if data['chunk_by'] != chunk_by:
+            return None
+        return parse_datetime(data['watermark']) if chunk_by == 'timestamp' else data['watermark']
+
+    def store_watermark(self, watermark_file, chunk_by, watermark):
+        if watermark_file:
+            with open(watermark_file, 'w') as file_out:
+                json.dump({'chunk_by': chunk_by, 'watermark': watermark}, file_out, cls=DjangoJSONEncoder)
+
+    def get_batch(self, qs, chunk_by, watermark, batch_size):
+        """
+        Returns queryset of the next batch, its watermark and count of its requests or None if nothing remains.
+        """
+        field = 'pk' if chunk_by == 'pk' else 'request_timestamp'
+        if watermark is not None:
+            qs = qs.filter(**{'%s__gt' % field: watermark})
+        keys = list(qs.order_by(field).values_list(field, flat=True)[:batch_size])
+        if not keys:
+            return None
+
+        batch_qs = qs.filter(**{'%s__lte' % field: keys[-1]})
+        # Timestamps are not unique, the batch can be greater than the batch size
+        return batch_qs, keys[-1], len(keys) if chunk_by == 'pk' else batch_qs.count()
+
+    def purge_in_batches(self, qs, batch_size, chunk_by, sleep, max_runtime, watermark_file):
+        watermark = self.load_watermark(watermark_file, chunk_by)
+        if watermark is not None:
+            self.stdout.write('Resuming from %s %s' % (chunk_by, watermark))
+
+        start = time_module.time()
+        removed = 0
+        while True:
+            batch = self.get_batch(qs, chunk_by, watermark, batch_size)
+            if batch is None:
+                break
+
+            batch_qs, watermark, count = batch
+            batch_qs.delete()
+            self.store_watermark(watermark_file, chunk_by, watermark)
+            removed += count
+            elapsed = time_module.time() - start
+            self.stdout.write(4 * ' ' + 'Removed %d requests up to %s %s (%d requests/s)' % (
+                removed, chunk_by, watermark, removed / max(elapsed, 0.001)))
+
+            if max_runtime is not None and elapsed >= max_runtime:
+                self.stdout.write('Maximal runtime exceeded, run the command again to continue')
+                break
+            if sleep:
+                time_module.sleep(sleep)
+
+        elapsed = time_module.time() - start
+        self.stdout.write('Removed %d requests in %.1f s (%d requests/s)' % (
+            removed, elapsed, removed / max(elapsed, 0.001)))
+        if watermark_file and batch is None and os.path.isfile(watermark_file):
+            os.remove(watermark_file)
 
     def handle(self, amount, duration, **options):
         # Check we have the correct values
@@ -78,7 +149,28 @@ class Command(BaseCommand):
             self.stderr.write('Amount must be %s' % ', '.join(DURATION_OPTIONS))
             return
 
-        qs = LoggedRequest.objects.filter(request_timestamp__lte=DURATION_OPTIONS[duration_plural](amount))
+        cutoff = DURATION_OPTIONS[duration_plural](amount)
+
+        if options.get('rollups'):
+            rollups_qs = LoggedRequestRollup.objects.filter(minute__lte=cutoff)
+            self.stdout.write('Removing %d request rollups' % rollups_qs.count())
+            rollups_qs.delete()
+            return
+
+        storage = get_log_storage()
+        if not isinstance(storage, ModelLogStorage):
+            # Requests are not stored in the database, the storage removes its own data
+            if options.get('interactive') and raw_input(
+                    'Remove requests stored by %s created before %d %s ago? Type \'yes\' to continue: ' % (
+                        storage.__class__.__name__, amount, duration)) != 'yes':
+                return
+            try:
+                self.stdout.write('Removed %s' % storage.purge(cutoff))
+            except (NotImplementedError, IOError, OSError) as ex:
+                self.stderr.write(force_text(ex))
+            return
+
+        qs = LoggedRequest.objects.filter(request_timestamp__lte=cutoff)
         count = qs.count()
 
         if count == 0:
@@ -99,8 +191,19 @@ class Command(BaseCommand):
         if confirm == 'yes':
             try:
                 if options.get('backup'):
-                    self.backup_to_file(qs, options.get('backup'))
+                    self.backup_to_file(qs, options.get('backup'), options.get('backup_format'),
+                                        options.get('workers'))
                 self.stdout.write('Removing data')
-                qs.delete()
+                if LOG_PARTITIONING and is_partitioned():
+                    # Whole partitions are dropped, the remaining requests are removed row by row
+                    for partition in drop_partitions(cutoff):
+                        self.stdout.write(4 * ' ' + 'Dropped partition %s' % partition.name)
+                if options.get('batch_size'):
+                    self.purge_in_batches(qs, options['batch_size'], options['chunk_by'], options['sleep'],
+                                          options['max_runtime'], options['watermark_file'])
+                else:
+                    qs.delete()
+                if LOG_PAYLOAD_DEDUPLICATION:
+                    self.stdout.write('Removed %d unused request payloads' % RequestPayload.objects.delete_unused())
             except IOError as ex:
                 self.stderr.write(force_text(ex))
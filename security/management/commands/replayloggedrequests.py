@@ -0,0 +1,241 @@
+import threading
+import time
+
+from collections import Counter
+from datetime import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Max
+from django.test.client import Client
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.encoding import force_bytes
+from django.utils.six.moves import queue
+from django.utils.six.moves.urllib.error import HTTPError
+from django.utils.six.moves.urllib.parse import urlencode
+from django.utils.six.moves.urllib.request import Request, urlopen
+
+from security.models import LoggedRequest
+from security.backup import iterate_rows, read_backup
+
+
+# Headers which are set by the client or the server
+SKIPPED_HEADERS = ('HOST', 'CONTENT_LENGTH', 'CONNECTION')
+
+
+def percentile(values, percent):
+    """
+    Returns percentile of the sorted values.
+    """
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(round(percent / 100.0 * (len(values) - 1))))]
+
+
+class ClientSender(object):
+    """
+    Sends requests through the Django test client, every thread has its own client. Requests throttled by
+    LogMiddleware (including the banned ones) are recognized by the throttled attribute of the response.
+    """
+
+    def __init__(self, content_type):
+        self.content_type = content_type
+        self._local = threading.local()
+
+    def send(self, row):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = Client()
+        extra = dict(('HTTP_%s' % name, value) for name, value in (row.get('headers') or {}).items()
+                     if name not in SKIPPED_HEADERS)
+        extra.update(QUERY_STRING=urlencode(row.get('queries') or {}), REMOTE_ADDR=row['ip'])
+        if row.get('is_secure'):
+            extra['wsgi.url_scheme'] = 'https'
+        response = client.generic(row['method'], row['path'], data=force_bytes(row.get('body') or ''),
+                                  content_type=self.content_type, **extra)
+        return response.status_code, getattr(response, 'throttled', False)
+
+    def close(self):
+        # Every worker thread has its own database connection
+        connection.close()
+
+
+class ServerSender(object):
+    """
+    Sends requests to the running server, IP address of the logged request is sent in X-Forwarded-For header.
+    Responses with the throttled status code are counted as throttled.
+    """
+
+    def __init__(self, url, content_type, timeout, throttled_status_code):
+        self.url = url.rstrip('/')
+        self.content_type = content_type
+        self.timeout = timeout
+        self.throttled_status_code = throttled_status_code
+
+    def send(self, row):
+        queries = row.get('queries')
+        url = '%s%s%s' % (self.url, row['path'], '?%s' % urlencode(queries) if queries else '')
+        body = force_bytes(row.get('body') or '') or None
+        request = Request(url, data=body)
+        request.get_method = lambda: row['method']
+        for name, value in (row.get('headers') or {}).items():
+            if name not in SKIPPED_HEADERS:
+                request.add_header(name.replace('_', '-').title(), value)
+        request.add_header('X-Forwarded-For', row['ip'])
+        if body is not None:
+            request.add_header('Content-Type', self.content_type)
+        try:
+            response = urlopen(request, timeout=self.timeout)
+        except HTTPError as ex:
+            status_code = ex.code
+        else:
+            response.read()
+            response.close()
+            status_code = response.getcode()
+        return status_code, status_code == self.throttled_status_code
+
+    def close(self):
+        pass
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--from', action='store', dest='start', default=None,
+            help='Replays requests created at or after the datetime (only requests from the database).'),
+        make_option('--to', action='store', dest='end', default=None,
+            help='Replays requests created at or before the datetime (only requests from the database).'),
+        make_option('--limit', action='store', dest='limit', type='int', default=None,
+            help='Maximal number of replayed requests.'),
+        make_option('--concurrency', action='store', dest='concurrency', type='int', default=1,
+            help='Number of threads which send requests.'),
+        make_option('--speed', action='store', dest='speed', type='float', default=1,
+            help='Speed multiplier of the original request times, 0 sends requests as fast as possible.'),
+        make_option('--url', action='store', dest='url', default=None,
+            help='Base URL of the server, requests are sent through the Django test client if it is not set.'),
+        make_option('--content-type', action='store', dest='content_type',
+            default='application/x-www-form-urlencoded', help='Content type of request bodies.'),
+        make_option('--timeout', action='store', dest='timeout', type='float', default=30,
+            help='Timeout of requests sent to the server in seconds.'),
+        make_option('--throttled-status', action='store', dest='throttled_status', type='int', default=429,
+            help='Status code of throttled responses of the server (THROTTLING_FAILURE_VIEW).'),
+    )
+    help = ('Replays logged requests from the database or from backup files and reports throughput, latencies and '
+            'count of throttled requests. Requests replayed through the test client are logged by LogMiddleware.')
+    args = '[backup file backup file ...]'
+
+    def parse_datetime(self, value):
+        if value is None:
+            return None
+
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise CommandError('Invalid datetime %s' % value)
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed, timezone.get_default_timezone())
+        return parsed
+
+    def get_rows(self, file_paths, start, end):
+        if file_paths:
+            for file_path in file_paths:
+                for row in read_backup(file_path):
+                    yield row
+        else:
+            # Replayed requests are logged to the same table, only requests logged before the replay are loaded
+            max_pk = LoggedRequest.objects.aggregate(max_pk=Max('pk'))['max_pk']
+            if max_pk is None:
+                return
+            qs = LoggedRequest.objects.filter(pk__lte=max_pk)
+            if start is not None:
+                qs = qs.filter(request_timestamp__gte=start)
+            if end is not None:
+                qs = qs.filter(request_timestamp__lte=end)
+            for row in iterate_rows(qs):
+                yield row
+
+    def get_timestamp(self, row):
+        request_timestamp = row['request_timestamp']
+        if not isinstance(request_timestamp, datetime):
+            request_timestamp = parse_datetime(request_timestamp)
+        if timezone.is_naive(request_timestamp):
+            request_timestamp = timezone.make_aware(request_timestamp, timezone.get_default_timezone())
+        return request_timestamp
+
+    def replay(self, sender, rows, concurrency, speed, limit):
+        """
+        Rows are scheduled by the main thread according to their original times, worker threads send them.
+        """
+        tasks = queue.Queue(concurrency * 2)
+        results = []
+        lock = threading.Lock()
+
+        def work():
+            try:
+                while True:
+                    row = tasks.get()
+                    if row is None:
+                        return
+                    request_start = time.time()
+                    try:
+                        status_code, throttled = sender.send(row)
+                    except Exception:
+                        # Connection errors and exceptions raised by views through the test client
+                        status_code, throttled = None, False
+                    with lock:
+                        results.append((status_code, throttled, (time.time() - request_start) * 1000))
+            finally:
+                sender.close()
+
+        workers = [threading.Thread(target=work) for i in range(concurrency)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        start = time.time()
+        first_timestamp = None
+        try:
+            for i, row in enumerate(rows):
+                if limit is not None and i >= limit:
+                    break
+                if speed:
+                    timestamp = self.get_timestamp(row)
+                    first_timestamp = first_timestamp or timestamp
+                    delay = start + (timestamp - first_timestamp).total_seconds() / speed - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                tasks.put(row)
+        finally:
+            for worker in workers:
+                tasks.put(None)
+            for worker in workers:
+                worker.join()
+        return results, time.time() - start
+
+    def report(self, results, elapsed):
+        latencies = sorted(latency for _, _, latency in results)
+        status_codes = Counter(status_code for status_code, _, _ in results)
+        throttled = sum(1 for _, is_throttled, _ in results if is_throttled)
+        self.stdout.write('Replayed %d requests in %.1f s (%.1f requests/s)' % (
+            len(results), elapsed, len(results) / max(elapsed, 0.001)))
+        self.stdout.write('Latency p50 %.1f ms, p90 %.1f ms, p99 %.1f ms, max %.1f ms' % (
+            percentile(latencies, 50), percentile(latencies, 90), percentile(latencies, 99),
+            latencies[-1] if latencies else 0))
+        self.stdout.write('Throttled %d requests, failed %d requests' % (throttled, status_codes[None]))
+        self.stdout.write('Status codes: %s' % ', '.join('%s: %d' % (status_code, status_codes[status_code])
+                                                       for status_code in sorted(filter(None, status_codes))))
+
+    def handle(self, *file_paths, **options):
+        if options.get('concurrency') < 1:
+            raise CommandError('Concurrency must be at least 1')
+
+        if options.get('url'):
+            sender = ServerSender(options['url'], options['content_type'], options['timeout'],
+                                  options['throttled_status'])
+        else:
+            sender = ClientSender(options['content_type'])
+
+        rows = self.get_rows(file_paths, self.parse_datetime(options.get('start')),
+                             self.parse_datetime(options.get('end')))
+        results, elapsed = self.replay(sender, rows, options['concurrency'], options['speed'], options['limit'])
+        self.report(results, elapsed)
@@ -0,0 +1,87 @@
+import json
+import os
+
+from datetime import datetime, time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
+
+from security.models import LoggedRequest
+from security.archive import ArchiveError, search_archive
+from security.backup import BACKUP_EXTENSIONS, INDEXED_FORMAT, get_index_file_path
+
+
+STATUSES = dict((name, status) for status, name in (
+    (LoggedRequest.FINE, 'fine'),
+    (LoggedRequest.WARNING, 'warning'),
+    (LoggedRequest.ERROR, 'error'),
+))
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--ip', action='store', dest='ip', default=None,
+            help='IP address of requests.'),
+        make_option('--path', action='store', dest='path', default=None,
+            help='Prefix of paths of requests.'),
+        make_option('--status', action='append', dest='statuses', type='choice', choices=tuple(STATUSES),
+            default=[], help='Status of requests (fine, warning or error), the option can be repeated.'),
+        make_option('--from', action='store', dest='start', default=None,
+            help='Requests created at or after the date or datetime.'),
+        make_option('--to', action='store', dest='end', default=None,
+            help='Requests created at or before the date or datetime.'),
+        make_option('--limit', action='store', dest='limit', type='int', default=None,
+            help='Maximal number of printed requests.'),
+    )
+    help = ('Searches requests in indexed backups created by purgeloggedrequests --backup-format=indexed command, '
+            'matching requests are printed as one JSON object per line.')
+    args = '<backup file or directory backup file or directory ...>'
+
+    def parse_datetime(self, value, end=False):
+        if value is None:
+            return None
+
+        parsed = parse_datetime(value)
+        if parsed is None:
+            date = parse_date(value)
+            if date is None:
+                raise CommandError('Invalid date or datetime %s' % value)
+            parsed = datetime.combine(date, time.max if end else time.min)
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed, timezone.get_default_timezone())
+        return parsed
+
+    def get_archives(self, paths):
+        extension = BACKUP_EXTENSIONS[INDEXED_FORMAT]
+        file_paths = []
+        for path in paths:
+            if os.path.isdir(path):
+                file_paths.extend(os.path.join(path, file_name) for file_name in os.listdir(path)
+                                  if file_name.endswith(extension))
+            else:
+                file_paths.append(path)
+        return [(file_path, get_index_file_path(file_path)) for file_path in sorted(file_paths)
+                if file_path.endswith(extension) and os.path.isfile(get_index_file_path(file_path))]
+
+    def handle(self, *paths, **options):
+        if not paths:
+            raise CommandError('Enter at least one backup file or directory')
+
+        start = self.parse_datetime(options.get('start'))
+        end = self.parse_datetime(options.get('end'), end=True)
+        statuses = set(STATUSES[status] for status in options.get('statuses'))
+        limit = options.get('limit')
+
+        count = 0
+        for file_path, index_path in self.get_archives(paths):
+            try:
+                for row in search_archive(file_path, index_path, options.get('ip'), options.get('path'),
+                                          statuses, start, end):
+                    self.stdout.write(json.dumps(row, separators=(',', ':')))
+                    count += 1
+                    if limit is not None and count >= limit:
+                        return
+            except (ArchiveError, IOError, ValueError) as ex:
+                self.stderr.write('%s: %s' % (file_path, ex))
@@ -1,48 +1,236 @@
+import random
+
+from collections import namedtuple
 from importlib import import_module
 
 from django.utils.encoding import force_text
 from django.core.urlresolvers import get_callable
 
-from ipware.ip import get_ip
-
-from .models import LoggedRequest
+from .models import LoggedRequest, LoggedRequestRollup
+from .bans import BanList
 from .exception import ThrottlingException
-from .config import DEFAULT_THROTTLING_VALIDATORS, THROTTLING_FAILURE_VIEW, LOG_IGNORE_IP
+from .counters import get_counter_backend
+from .throttling import ThrottlingPlan
+from .storage import get_log_storage
+from .writebehind import get_logged_request_writer
+from .signals import request_timings
+from .utils import BodyCaptureStream, IPSet, RequestTimings, get_request_info, monotonic
+from .config import (DEFAULT_THROTTLING_VALIDATORS, THROTTLING_FAILURE_VIEW, LOG_IGNORE_IP,
+                     LOG_SAMPLING, LOG_REQUEST_BODY_LENGTH, LOG_ROLLUPS, LOG_WRITE_BEHIND, THROTTLING_BAN)
+
+
+ViewPlan = namedtuple('ViewPlan', ('log_exempt', 'hide_request_body', 'throttling_exempt', 'throttling_plan',
+                                   'sample_rate'))
 
 
 class LogMiddleware(object):
+    """
+    Logs requests and validates throttling. The middleware is synchronous only, asynchronous middleware requires
+    Django 3.1 which is not supported by this library (it uses APIs removed in Django 2.0).
+    """
+
+    def __init__(self):
+        self.validators = tuple(import_module(DEFAULT_THROTTLING_VALIDATORS).validators)
+        self._view_plans = {}
+        self.ignore_ips = IPSet(LOG_IGNORE_IP)
+        # The longest path prefix has precedence
+        self.path_sample_rates = sorted(LOG_SAMPLING.items(), key=lambda item: len(item[0]), reverse=True)
+        self.ban_list = BanList() if THROTTLING_BAN else None
+        self.storage = get_log_storage()
+
+    def _compile_view_plan(self, callback):
+        throttling_exempt = getattr(callback, 'throttling_exempt', False)
+        validators = () if throttling_exempt else self.validators
+        # Validators added with security.decorators.throttling are validated by the middleware too
+        validators += tuple(getattr(callback, 'throttling_validators', ()))
+        return ViewPlan(
+            log_exempt=getattr(callback, 'log_exempt', False),
+            hide_request_body=getattr(callback, 'hide_request_body', False),
+            throttling_exempt=throttling_exempt,
+            throttling_plan=ThrottlingPlan(validators) if validators else None,
+            sample_rate=getattr(callback, 'log_sample_rate', None),
+        )
+
+    def _get_view_plan(self, callback):
+        try:
+            return self._view_plans[callback]
+        except KeyError:
+            view_plan = self._view_plans[callback] = self._compile_view_plan(callback)
+            return view_plan
+        except TypeError:
+            # Unhashable callback
+            return self._compile_view_plan(callback)
+
+    def _is_logged(self, request):
+        timings = request._security_timings = RequestTimings()
+        with timings.measure('ip_resolution'):
+            request_info = get_request_info(request)
+        return request_info.ip not in self.ignore_ips
+
+    def _prepare_logged_request(self, request):
+        with request._security_timings.measure('log_preparation'):
+            request._logged_request = self.storage.prepare_from_request(request)
+            if hasattr(request, '_stream') and not hasattr(request, '_body'):
+                # Body is captured while the view reads it, large uploads are not buffered
+                request._stream = request._body_capture = BodyCaptureStream(request._stream,
+                                                                            LOG_REQUEST_BODY_LENGTH + 1)
+
+    def _store_suppressed(self, bans):
+        for ban in bans:
+            logged_request = ban.to_logged_request()
+            self._store(logged_request)
+            self._count(logged_request, ban.suppressed)
 
     def process_request(self, request):
-        if get_ip(request) not in LOG_IGNORE_IP:
-            request._logged_request = LoggedRequest.objects.prepare_from_request(request)
+        if self._is_logged(request):
+            if self.ban_list is not None:
+                self._store_suppressed(self.ban_list.pop_expired())
+            self._prepare_logged_request(request)
+
+    def _get_ban_response(self, request):
+        """
+        Returns response of the ban or None if the client is not banned. Banned requests are neither validated
+        nor logged one by one.
+        """
+        ban = self.ban_list.get_ban(request)
+        if ban is None:
+            return None
+        del request._logged_request
+        self._hide_body(request)
+        response = self.ban_list.suppress(ban)
+        response.throttled = True
+        return response
+
+    def _get_raw_body(self, request):
+        if hasattr(request, '_body_capture'):
+            return request._body_capture.get_captured()
+        return getattr(request, '_body', b'')
+
+    def _hide_body(self, request):
+        request._log_request_body = False
+        if hasattr(request, '_body_capture'):
+            request._body_capture.disable()
 
     def _render_throttling(self, request, exception):
         return get_callable(THROTTLING_FAILURE_VIEW)(request, exception)
 
+    def _apply_view_plan(self, request, view_plan):
+        """
+        Returns False if the request is exempted from logging.
+        """
+        # Exempt all logs
+        if view_plan.log_exempt:
+            del request._logged_request
+            self._hide_body(request)
+            return False
+
+        # Body is included if the request throw exception inside process_request of some Middleware
+        if view_plan.hide_request_body:
+            self._hide_body(request)
+
+        request._log_sample_rate = view_plan.sample_rate
+
+        # Validators of the view plan are not validated again by the throttling decorator
+        if view_plan.throttling_plan:
+            request._throttling_validated = set(view_plan.throttling_plan.validators)
+        return True
+
     def process_view(self, request, callback, callback_args, callback_kwargs):
         if getattr(request, '_logged_request', False):
+            view_plan = self._get_view_plan(callback)
+            if not self._apply_view_plan(request, view_plan):
+                return
 
-            # Exempt all logs
-            if getattr(callback, 'log_exempt', False):
-                del request._logged_request
-
-            # TODO: this is not the best solution if the request throw exception inside process_request of some Middleware
-            # the bode will be included (But I didn't have better solution now)
-            if getattr(callback, 'hide_request_body', False):
-                request._logged_request.body = ''
+            # Throttling exempted views are not banned
+            if self.ban_list is not None and not view_plan.throttling_exempt:
+                response = self._get_ban_response(request)
+                if response is not None:
+                    return response
 
             # Check if throttling is not exempted
-            if not getattr(callback, 'throttling_exempt', False):
+            if view_plan.throttling_plan:
                 try:
-                    for validator in import_module(DEFAULT_THROTTLING_VALIDATORS).validators:
-                        validator.validate(request)
+                    with request._security_timings.measure('throttling'):
+                        view_plan.throttling_plan.validate(request)
                 except ThrottlingException as exception:
                     return self.process_exception(request, exception)
 
+        if hasattr(request, '_security_timings'):
+            request._view_start = monotonic()
+
+    def _store(self, logged_request):
+        self.storage.store(logged_request)
+
+    def _count(self, logged_request, count=1):
+        """
+        Counter backends and rollups which do not count stored rows get every request.
+        """
+        get_counter_backend().increment(logged_request, count)
+        if LOG_ROLLUPS and LOG_WRITE_BEHIND:
+            # Rollups are written by the background thread with the logged requests
+            get_logged_request_writer().increment_rollup(logged_request, count)
+        elif LOG_ROLLUPS:
+            LoggedRequestRollup.objects.increment_from_logged_request(logged_request, count)
+
+    def _get_sample_rate(self, request):
+        sample_rate = getattr(request, '_log_sample_rate', None)
+        if sample_rate is None:
+            path = get_request_info(request).path
+            for path_prefix, path_sample_rate in self.path_sample_rates:
+                if path.startswith(path_prefix):
+                    return path_sample_rate
+        return sample_rate
+
+    def _get_sample_weight(self, request, logged_request, response):
+        """
+        Returns weight of the stored request or None if the request should not be stored. Throttled, login and not
+        successful requests are always stored.
+        """
+        if logged_request.type != LoggedRequest.COMMON_REQUEST or not 200 <= response.status_code < 300:
+            return 1
+
+        sample_rate = self._get_sample_rate(request)
+        if sample_rate is None or sample_rate >= 1:
+            return 1
+
+        sample_weight = int(round(1 / float(sample_rate))) if sample_rate > 0 else None
+        return sample_weight if sample_weight and random.random() * sample_weight < 1 else None
+
+    def _update_logged_request(self, request, response):
+        """
+        Completes the logged request from the response, returns None if the request is not logged.
+        """
+        timings = request._security_timings
+        if hasattr(request, '_view_start'):
+            timings.add('view', monotonic() - request._view_start)
+
+        logged_request = getattr(request, '_logged_request', None)
+        if logged_request is not None:
+            if getattr(request, '_log_request_body', True):
+                logged_request.update_body(self._get_raw_body(request))
+            logged_request.update_from_response(response)
+            logged_request.response_duration = timings.get_elapsed()
+        return logged_request
+
+    def _save_logged_request(self, request, logged_request, response):
+        timings = request._security_timings
+        if logged_request is not None:
+            with timings.measure('log_save'):
+                sample_weight = self._get_sample_weight(request, logged_request, response)
+                if sample_weight is not None:
+                    logged_request.sample_weight = sample_weight
+                    self._store(logged_request)
+                self._count(logged_request)
+
+        request_timings.send(sender=self.__class__, request=request, logged_request=logged_request,
+                             timings=timings.phases)
+
     def process_response(self, request, response):
-        if hasattr(request, '_logged_request'):
-            request._logged_request.update_from_response(response)
-            request._logged_request.save()
+        if not hasattr(request, '_security_timings'):
+            # process_request of the middleware was not called
+            return response
+
+        self._save_logged_request(request, self._update_logged_request(request, response), response)
         return response
 
     def process_exception(self, request, exception):
@@ -50,4 +238,9 @@ class LogMiddleware(object):
             logged_request = request._logged_request
             logged_request.type = LoggedRequest.THROTTLED_REQUEST
             logged_request.error_description = force_text(exception)
-            return self._render_throttling(request, exception)
+            response = self._render_throttling(request, exception)
+            # In-process clients (e.g. replayloggedrequests) recognize throttled responses of any status code
+            response.throttled = True
+            if self.ban_list is not None and exception.validator is not None:
+                self.ban_list.ban(request, exception.validator, response)
+            return response
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'RequestPayload'
+        db.create_table(u'security_requestpayload', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('hash', self.gf('django.db.models.fields.CharField')(unique=True, max_length=64)),
+            ('data', self.gf('json_field.fields.JSONField')(default=u'null', null=True, blank=True)),
+        ))
+        db.send_create_signal(u'security', ['RequestPayload'])
+
+        # Adding field 'LoggedRequest.headers_payload'
+        db.add_column(u'security_loggedrequest', 'headers_payload',
+                      self.gf('django.db.models.fields.related.ForeignKey')(blank=True, related_name=u'logged_requests_by_headers', null=True, on_delete=models.PROTECT, to=orm['security.RequestPayload']),
+                      keep_default=False)
+
+        # Adding field 'LoggedRequest.queries_payload'
+        db.add_column(u'security_loggedrequest', 'queries_payload',
+                      self.gf('django.db.models.fields.related.ForeignKey')(blank=True, related_name=u'logged_requests_by_queries', null=True, on_delete=models.PROTECT, to=orm['security.RequestPayload']),
+                      keep_default=False)
+
+    def backwards(self, orm):
+        # Deleting field 'LoggedRequest.headers_payload'
+        db.delete_column(u'security_loggedrequest', 'headers_payload_id')
+
+        # Deleting field 'LoggedRequest.queries_payload'
+        db.delete_column(u'security_loggedrequest', 'queries_payload_id')
+
+        # Deleting model 'RequestPayload'
+        db.delete_table(u'security_requestpayload')
+
+    models = {
+        u'security.loggedrequest': {
+            'Meta': {'ordering': "(u'-request_timestamp',)", 'index_together': "((u'ip', u'path', u'method', u'request_timestamp'), (u'ip', u'path', u'type', u'request_timestamp'))", 'object_name': 'LoggedRequest'},
+            'body': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'error_description': ('django.db.models.fields.CharField', [], {'max_length': '255', 'null': 'True', 'blank': 'True'}),
+            'headers': ('json_field.fields.JSONField', [], {'default': "u'null'", 'null': 'True', 'blank': 'True'}),
+            'headers_payload': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "u'logged_requests_by_headers'", 'null': 'True', 'on_delete': 'models.PROTECT', 'to': u"orm['security.RequestPayload']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'ip': ('django.db.models.fields.IPAddressField', [], {'max_length': '15'}),
+            'is_secure': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'method': ('django.db.models.fields.CharField', [], {'max_length': '7'}),
+            'path': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'queries': ('json_field.fields.JSONField', [], {'default': "u'null'", 'null': 'True', 'blank': 'True'}),
+            'queries_payload': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "u'logged_requests_by_queries'", 'null': 'True', 'on_delete': 'models.PROTECT', 'to': u"orm['security.RequestPayload']"}),
+            'request_timestamp': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            'response_code': ('django.db.models.fields.PositiveSmallIntegerField', [], {}),
+            'response_duration': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'response_timestamp': ('django.db.models.fields.DateTimeField', [], {}),
+            'sample_weight': ('django.db.models.fields.PositiveIntegerField', [], {'default': '1'}),
+            'status': ('django.db.models.fields.PositiveSmallIntegerField', [], {}),
+            'type': ('django.db.models.fields.PositiveSmallIntegerField', [], {'default': '1'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['users.User']", 'null': 'True', 'blank': 'True'})
+        },
+        u'security.loggedrequestrollup': {
+            'Meta': {'ordering': "(u'-minute',)", 'unique_together': "((u'ip', u'path', u'method', u'type', u'minute'),)", 'index_together': "((u'ip', u'path', u'type', u'minute'),)", 'object_name': 'LoggedRequestRollup'},
+            'count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'ip': ('django.db.models.fields.IPAddressField', [], {'max_length': '15'}),
+            'method': ('django.db.models.fields.CharField', [], {'max_length': '7'}),
+            'minute': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            'path': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'type': ('django.db.models.fields.PositiveSmallIntegerField', [], {})
+        },
+        u'security.requestpayload': {
+            'Meta': {'object_name': 'RequestPayload'},
+            'data': ('json_field.fields.JSONField', [], {'default': "u'null'", 'null': 'True', 'blank': 'True'}),
+            'hash': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '64'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        u'users.user': {
+            'Meta': {'object_name': 'User'},
+            'email': ('django.db.models.fields.EmailField', [], {'unique': 'True', 'max_length': '75'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_verified': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'language_code': ('django.db.models.fields.CharField', [], {'default': "u'cs'", 'max_length': '10'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'null': 'True', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'phone': ('django.db.models.fields.CharField', [], {'max_length': '100', 'null': 'True', 'blank': 'True'}),
+            'photo': ('is_core.models.fields.ImageField', [], {'max_length': '100', 'null': 'True', 'blank': 'True'}),
+            'role': ('django.db.models.fields.PositiveSmallIntegerField', [], {}),
+            'salutation': ('django.db.models.fields.CharField', [], {'max_length': '200', 'null': 'True', 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['security']
@@ -1,38 +1,150 @@
 from __future__ import unicode_literals
 
-from django.db import models
+import hashlib
+import json
+
+from django.db import models, connections, router, transaction, IntegrityError
+from django.db.models import Q
 from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
 from django.utils import timezone
 from django.template.defaultfilters import truncatechars
-from django.utils.encoding import force_text
+from django.utils.encoding import force_text, force_bytes
+from django.core.serializers.json import DjangoJSONEncoder
 
 from json_field.fields import JSONField
 
-from ipware.ip import get_ip
-
-from security.config import LOG_REQUEST_BODY_LENGTH
-from security.utils import get_headers
+from security.config import LOG_REQUEST_BODY_LENGTH, LOG_LIST_EXACT_COUNT_LIMIT
+from security.utils import get_headers, get_request_info
 
 
 # Prior to Django 1.5, the AUTH_USER_MODEL setting does not exist.
 AUTH_USER_MODEL = getattr(settings, 'AUTH_USER_MODEL', 'auth.User')
 
+# References of LoggedRequest to the deduplicated RequestPayload rows
+PAYLOAD_FIELD_NAMES = ('headers_payload', 'queries_payload')
+
+
+def get_payload_hash(data):
+    """
+    Returns SHA-256 hash of the canonical JSON representation of the data.
+    """
+    return hashlib.sha256(force_bytes(json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True,
+                                                 separators=(',', ':')))).hexdigest()
+
+
+class LoggedRequestQuerySet(models.query.QuerySet):
+    """
+    Query set with keyset pagination and estimated count for listing of large tables
+    """
+
+    estimated = False
+
+    def _clone(self, *args, **kwargs):
+        kwargs.setdefault('estimated', self.estimated)
+        return super(LoggedRequestQuerySet, self)._clone(*args, **kwargs)
+
+    def with_estimated_count(self):
+        """
+        count() returns planner estimate instead of the exact count if the estimate exceeds
+        LOG_LIST_EXACT_COUNT_LIMIT. The estimate is supported only by PostgreSQL.
+        """
+        return self._clone(estimated=True)
+
+    def after(self, request_timestamp, pk):
+        """
+        Returns requests which follow the request identified by request_timestamp and pk in the
+        (-request_timestamp, -id) ordering. The page is read from the request_timestamp index at any depth.
+        """
+        return self.filter(
+            Q(request_timestamp__lt=request_timestamp) | Q(request_timestamp=request_timestamp, pk__lt=pk)
+        ).order_by('-request_timestamp', '-pk')
+
+    def _estimate_count(self):
+        connection = connections[self.db]
+        if connection.vendor != 'postgresql':
+            return None
+
+        sql, params = self.query.sql_with_params()
+        cursor = connection.cursor()
+        cursor.execute('EXPLAIN (FORMAT JSON) %s' % sql, params)
+        plan = cursor.fetchone()[0]
+        if not isinstance(plan, list):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    def count(self):
+        if self.estimated and self._result_cache is None:
+            estimate = self._estimate_count()
+            if estimate is not None and estimate > LOG_LIST_EXACT_COUNT_LIMIT:
+                return estimate
+        return super(LoggedRequestQuerySet, self).count()
+
 
 class LoggedRequestManager(models.Manager):
     """
     Create new LoggedRequest instance from HTTP request
     """
 
+    def get_queryset(self):
+        return LoggedRequestQuerySet(self.model, using=self._db)
+
+    def deduplicate_payloads(self, logged_requests):
+        """
+        Replaces headers and queries of the logged requests with references to RequestPayload rows, distinct
+        payloads of all requests are loaded by one query and the missing ones are created by one bulk insert.
+        """
+        references = []
+        payloads = {}
+        for logged_request in logged_requests:
+            for field_name in ('headers', 'queries'):
+                data = getattr(logged_request, field_name)
+                if data is not None:
+                    payload_hash = get_payload_hash(data)
+                    payloads[payload_hash] = data
+                    references.append((logged_request, field_name, payload_hash))
+
+        payload_ids = RequestPayload.objects.get_ids(payloads) if payloads else {}
+        for logged_request, field_name, payload_hash in references:
+            setattr(logged_request, '%s_payload_id' % field_name, payload_ids[payload_hash])
+            setattr(logged_request, field_name, None)
+
+    def deduplicate_and_store(self, logged_requests, store):
+        """
+        Deduplicates payloads of the logged requests and stores them by the store function. Payload can be removed
+        by the concurrent purge after it was loaded, the store is therefore repeated once with recreated payloads
+        if some referenced payload does not exist.
+        """
+        original_payloads = [(logged_request, logged_request.headers, logged_request.queries)
+                             for logged_request in logged_requests]
+        for attempt in range(2):
+            self.deduplicate_payloads(logged_requests)
+            try:
+                with transaction.atomic(using=router.db_for_write(self.model)):
+                    store(logged_requests)
+                return
+            except IntegrityError:
+                payload_ids = set(
+                    getattr(logged_request, '%s_id' % field_name) for logged_request in logged_requests
+                    for field_name in PAYLOAD_FIELD_NAMES
+                ) - {None}
+                if attempt or RequestPayload.objects.filter(pk__in=payload_ids).count() == len(payload_ids):
+                    raise
+                for logged_request, headers, queries in original_payloads:
+                    logged_request.pk = None
+                    logged_request.headers, logged_request.queries = headers, queries
+
     def prepare_from_request(self, request):
+        """
+        Request body is not read, it is set by update_body when the view is known.
+        """
+        request_info = get_request_info(request)
         user = hasattr(request, 'user') and request.user.is_authenticated() and request.user or None
-        path = truncatechars(request.path, 200)
-        body = truncatechars(force_text(request.body[:LOG_REQUEST_BODY_LENGTH + 1],
-                                        errors='replace'), LOG_REQUEST_BODY_LENGTH)
+        path = truncatechars(request_info.path, 200)
 
-        return self.model(headers=get_headers(request), body=body, user=user, method=request.method.upper(),
+        return self.model(headers=get_headers(request), body='', user=user, method=request_info.method,
                            path=path, queries=request.GET.dict(), is_secure=request.is_secure(),
-                           ip=get_ip(request), request_timestamp=timezone.now())
+                           ip=request_info.ip, request_timestamp=request_info.timestamp)
 
 
 class LoggedRequest(models.Model):
@@ -62,7 +174,7 @@ class LoggedRequest(models.Model):
     objects = LoggedRequestManager()
 
     # Request information
-    request_timestamp = models.DateTimeField(_('Request timestamp'), null=False, blank=False)
+    request_timestamp = models.DateTimeField(_('Request timestamp'), null=False, blank=False, db_index=True)
     method = models.CharField(_('Method'), max_length=7, null=False, blank=False)
     path = models.CharField(_('URL path'), max_length=255, null=False, blank=False)
     queries = JSONField(_('Queries'), null=True, blank=True)
@@ -77,10 +189,21 @@ class LoggedRequest(models.Model):
     type = models.PositiveSmallIntegerField(_('Request type'), choices=TYPE_CHOICES, default=COMMON_REQUEST, null=False,
                                             blank=False)
     error_description = models.CharField(_('Error description'), max_length=255, null=True, blank=True)
+    response_duration = models.PositiveIntegerField(_('Response duration (microseconds)'), null=True, blank=True)
+
+    # Deduplicated headers and queries (LOG_PAYLOAD_DEDUPLICATION setting)
+    headers_payload = models.ForeignKey('RequestPayload', verbose_name=_('Headers payload'), null=True, blank=True,
+                                        on_delete=models.PROTECT, related_name='logged_requests_by_headers')
+    queries_payload = models.ForeignKey('RequestPayload', verbose_name=_('Queries payload'), null=True, blank=True,
+                                        on_delete=models.PROTECT, related_name='logged_requests_by_queries')
+
+    # Sampling information, one stored request represents sample_weight requests
+    sample_weight = models.PositiveIntegerField(_('Sample weight'), default=1, null=False, blank=False)
 
     # User information
-    user = models.ForeignKey(AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
-    ip = models.IPAddressField(_('IP address'), null=False, blank=False)
+    # Without the database constraint, requests can be routed to the log database which does not contain the users
+    user = models.ForeignKey(AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, db_constraint=False)
+    ip = models.GenericIPAddressField(_('IP address'), null=False, blank=False)
 
     # Log information
     # TODO: is nessesary to relate thread with request.
@@ -93,6 +216,21 @@ class LoggedRequest(models.Model):
     def __unicode__(self):
         return self.short_path()
 
+    def headers_data(self):
+        return self.headers_payload.data if self.headers_payload_id is not None else self.headers
+    headers_data.short_description = _('Headers')
+
+    def queries_data(self):
+        return self.queries_payload.data if self.queries_payload_id is not None else self.queries
+    queries_data.short_description = _('Queries')
+
+    def resolve_payloads(self):
+        """
+        Sets headers and queries from the deduplicated payloads.
+        """
+        self.headers = self.headers_data()
+        self.queries = self.queries_data()
+
     def get_status(self, response):
         if response.status_code >= 500:
             return LoggedRequest.ERROR
@@ -101,6 +239,10 @@ class LoggedRequest(models.Model):
         else:
             return LoggedRequest.FINE
 
+    def update_body(self, raw_body):
+        self.body = truncatechars(force_text(raw_body[:LOG_REQUEST_BODY_LENGTH + 1], errors='replace'),
+                                  LOG_REQUEST_BODY_LENGTH)
+
     def update_from_response(self, response, status=None, type=None, error_description=None):
         self.response_timestamp = timezone.now()
         self.status = status or self.get_status(response)
@@ -111,10 +253,159 @@ class LoggedRequest(models.Model):
             self.error_description = error_description
 
     def response_time(self):
-        return '%s ms' % ((self.response_timestamp - self.request_timestamp).microseconds / 1000)
+        if self.response_duration is not None:
+            return '%s ms' % (self.response_duration // 1000)
+        return '%s ms' % int((self.response_timestamp - self.request_timestamp).total_seconds() * 1000)
     response_time.short_description = _('Response time')
 
     class Meta:
         ordering = ('-request_timestamp',)
+        # Indexes match the throttling counts (equality columns first, timestamp range last)
+        index_together = (
+            ('ip', 'path', 'method', 'request_timestamp'),
+            ('ip', 'path', 'type', 'request_timestamp'),
+        )
         verbose_name = _('Logged request')
         verbose_name_plural = _('Logged requests')
+
+
+class LoggedRequestRollupManager(models.Manager):
+    """
+    Upserts per-minute request counts
+    """
+
+    def _upsert_postgresql(self, connection, values, count):
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        columns = [opts.get_field(name).column for name in values]
+        table = qn(opts.db_table)
+        cursor = connection.cursor()
+        cursor.execute(
+            'INSERT INTO %s (%s, %s) VALUES (%s, %%s) ON CONFLICT (%s) DO UPDATE SET %s = %s.%s + EXCLUDED.%s' % (
+                table, ', '.join(map(qn, columns)), qn('count'), ', '.join(['%s'] * len(columns)),
+                ', '.join(map(qn, columns)), qn('count'), table, qn('count'), qn('count')
+            ), list(values.values()) + [count]
+        )
+
+    def increment(self, ip, path, method, type, timestamp, count=1):
+        values = dict(ip=ip, path=path, method=method, type=type,
+                      minute=timestamp.replace(second=0, microsecond=0))
+        using = router.db_for_write(self.model)
+        connection = connections[using]
+        if connection.vendor == 'postgresql':
+            self._upsert_postgresql(connection, values, count)
+        elif not self.using(using).filter(**values).update(count=models.F('count') + count):
+            try:
+                with transaction.atomic(using=using):
+                    self.using(using).create(count=count, **values)
+            except IntegrityError:
+                # Bucket was created by the concurrent request
+                self.using(using).filter(**values).update(count=models.F('count') + count)
+
+    def increment_from_logged_request(self, logged_request, count=1):
+        self.increment(logged_request.ip, logged_request.path, logged_request.method, logged_request.type,
+                       logged_request.request_timestamp, count)
+
+
+class LoggedRequestRollup(models.Model):
+    """
+    Count of requests with the same IP address, path, method and type per minute. Rollups are not removed with
+    the logged requests so they can be used for long-term statistics.
+    """
+
+    objects = LoggedRequestRollupManager()
+
+    minute = models.DateTimeField(_('Minute'), null=False, blank=False, db_index=True)
+    ip = models.GenericIPAddressField(_('IP address'), null=False, blank=False)
+    path = models.CharField(_('URL path'), max_length=255, null=False, blank=False)
+    method = models.CharField(_('Method'), max_length=7, null=False, blank=False)
+    type = models.PositiveSmallIntegerField(_('Request type'), choices=LoggedRequest.TYPE_CHOICES, null=False,
+                                            blank=False)
+    count = models.PositiveIntegerField(_('Count'), default=0, null=False, blank=False)
+
+    def __unicode__(self):
+        return '%s %s %s' % (self.minute, self.ip, self.path)
+
+    class Meta:
+        ordering = ('-minute',)
+        unique_together = ('ip', 'path', 'method', 'type', 'minute')
+        index_together = (
+            ('ip', 'path', 'type', 'minute'),
+        )
+        verbose_name = _('Logged request rollup')
+        verbose_name_plural = _('Logged request rollups')
+
+
+class RequestPayloadManager(models.Manager):
+
+    def get_ids(self, payloads):
+        """
+        Returns ids of payloads for the dict hash -> data, missing payloads are created.
+        """
+        payload_ids = dict(self.filter(hash__in=list(payloads)).values_list('hash', 'pk'))
+        missing_hashes = [payload_hash for payload_hash in payloads if payload_hash not in payload_ids]
+        if missing_hashes:
+            try:
+                with transaction.atomic(using=router.db_for_write(self.model)):
+                    self.bulk_create([self.model(hash=payload_hash, data=payloads[payload_hash])
+                                      for payload_hash in missing_hashes])
+            except IntegrityError:
+                # Some payloads were created by the concurrent request
+                for payload_hash in missing_hashes:
+                    self.get_or_create(hash=payload_hash, defaults={'data': payloads[payload_hash]})
+            payload_ids.update(self.filter(hash__in=missing_hashes).values_list('hash', 'pk'))
+        return payload_ids
+
+    def delete_unused(self, chunk_size=1000):
+        """
+        Removes payloads which are not referenced by any logged request, returns count of removed payloads.
+        Payloads are removed by ranges of chunk_size primary keys, every range is one DELETE with NOT EXISTS
+        conditions which use the indexes of the references. Range with a payload which was referenced by the
+        concurrently logged request is kept until the next purge.
+        """
+        using = router.db_for_write(self.model)
+        bounds = self.using(using).aggregate(min_pk=models.Min('pk'), max_pk=models.Max('pk'))
+        if bounds['min_pk'] is None:
+            return 0
+
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        pk_column = qn(self.model._meta.pk.column)
+        unused_condition = ' AND '.join(
+            'NOT EXISTS (SELECT 1 FROM %s WHERE %s = %s.%s)' % (
+                qn(LoggedRequest._meta.db_table), qn(LoggedRequest._meta.get_field(field_name).column), table,
+                pk_column
+            ) for field_name in PAYLOAD_FIELD_NAMES
+        )
+        count = 0
+        for start in range(bounds['min_pk'], bounds['max_pk'] + 1, chunk_size):
+            try:
+                with transaction.atomic(using=using):
+                    cursor = connection.cursor()
+                    cursor.execute('DELETE FROM %s WHERE %s >= %%s AND %s < %%s AND %s' % (
+                        table, pk_column, pk_column, unused_condition), [start, start + chunk_size])
+                    chunk_count = cursor.rowcount
+            except IntegrityError:
+                pass
+            else:
+                count += chunk_count
+        return count
+
+
+class RequestPayload(models.Model):
+    """
+    Distinct headers or queries shared by logged requests, payload is identified by the hash of its data.
+    """
+
+    objects = RequestPayloadManager()
+
+    hash = models.CharField(_('Hash'), max_length=64, null=False, blank=False, unique=True)
+    data = JSONField(_('Data'), null=True, blank=True)
+
+    def __unicode__(self):
+        return self.hash
+
+    class Meta:
+        verbose_name = _('Request payload')
+        verbose_name_plural = _('Request payloads')
@@ -0,0 +1,230 @@
+"""
+Range partitioning of the LoggedRequest table by request_timestamp (PostgreSQL 11 and newer).
+
+Partitions are daily or weekly tables named security_loggedrequest_pYYYYMMDD by the start of their range. Whole
+partitions older than the purge cutoff are detached and dropped instead of deleting their rows. Requests outside of
+the created ranges are stored to the default partition security_loggedrequest_default, therefore logging does not fail
+if partitions were not created in time. They are moved to the range partition when it is created.
+"""
+import re
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from django.db import connections, router, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import utc
+
+from .models import LoggedRequest
+from .config import LOG_PARTITIONING, LOG_PARTITIONS_AHEAD
+
+
+DAY = 'day'
+WEEK = 'week'
+
+PERIODS = {
+    DAY: timedelta(days=1),
+    WEEK: timedelta(weeks=1),
+}
+
+# Must match indexes of security.models.LoggedRequest
+PARTITIONED_INDEXES = (
+    ('request_timestamp',),
+    ('ip', 'path', 'method', 'request_timestamp'),
+    ('ip', 'path', 'type', 'request_timestamp'),
+    ('headers_payload_id',),
+    ('queries_payload_id',),
+)
+
+BOUND_RE = re.compile(r"FROM \((?P<start>[^)]+)\) TO \((?P<end>[^)]+)\)")
+
+Partition = namedtuple('Partition', ('name', 'start', 'end'))
+
+
+class PartitioningError(Exception):
+    pass
+
+
+def get_connection():
+    connection = connections[router.db_for_write(LoggedRequest)]
+    if connection.vendor != 'postgresql':
+        raise PartitioningError('Partitioning is supported only by PostgreSQL')
+    return connection
+
+
+def get_table_name():
+    return LoggedRequest._meta.db_table
+
+
+def get_period_start(timestamp, period=LOG_PARTITIONING):
+    start = datetime(timestamp.year, timestamp.month, timestamp.day, tzinfo=utc)
+    if period == WEEK:
+        start -= timedelta(days=start.weekday())
+    return start
+
+
+def get_partition_name(start):
+    return '%s_p%s' % (get_table_name(), start.strftime('%Y%m%d'))
+
+
+def get_default_partition_name():
+    return '%s_default' % get_table_name()
+
+
+def parse_bound(value):
+    value = value.strip()
+    if value.upper() == 'MINVALUE':
+        return None
+    # PostgreSQL writes UTC offset without minutes (+00)
+    value = re.sub(r'([+-]\d{2})$', r'\1:00', value.strip("'"))
+    return parse_datetime(value)
+
+
+def is_partitioned(connection=None):
+    connection = connection or get_connection()
+    cursor = connection.cursor()
+    cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s AND relkind IN ('p', 'r')", [get_table_name()])
+    row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def get_partitions(connection=None):
+    """
+    Returns list of partitions ordered by start of their range, start of the first one can be None (MINVALUE).
+    """
+    connection = connection or get_connection()
+    cursor = connection.cursor()
+    cursor.execute(
+        'SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) FROM pg_inherits '
+        'JOIN pg_class parent ON pg_inherits.inhparent = parent.oid '
+        'JOIN pg_class child ON pg_inherits.inhrelid = child.oid '
+        'WHERE parent.relname = %s', [get_table_name()]
+    )
+    partitions = []
+    for name, bound in cursor.fetchall():
+        match = BOUND_RE.search(bound)
+        if match:
+            partitions.append(Partition(name, parse_bound(match.group('start')), parse_bound(match.group('end'))))
+    return sorted(partitions, key=lambda partition: partition.start or datetime.min.replace(tzinfo=utc))
+
+
+def own_sequence(cursor, qn, partition_name):
+    """
+    Moves ownership of the primary key sequence from the partition to the partitioned table.
+    """
+    pk_column = LoggedRequest._meta.pk.column
+    cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [qn(partition_name), pk_column])
+    sequence = cursor.fetchone()[0]
+    if sequence is not None:
+        cursor.execute('ALTER SEQUENCE %s OWNED BY %s.%s' % (sequence, qn(get_table_name()), qn(pk_column)))
+
+
+def setup_partitioning(period=LOG_PARTITIONING):
+    """
+    Converts the LoggedRequest table to the partitioned one. The existing table is attached as the first partition
+    which contains all requests until the end of the current period. Foreign keys of the existing table are
+    recreated on the partitioned table.
+    """
+    connection = get_connection()
+    if is_partitioned(connection):
+        raise PartitioningError('Table %s is already partitioned' % get_table_name())
+
+    qn = connection.ops.quote_name
+    table = get_table_name()
+    legacy_table = '%s_legacy' % table
+    pk_column = LoggedRequest._meta.pk.column
+    end = get_period_start(timezone.now(), period) + PERIODS[period]
+
+    cursor = connection.cursor()
+    cursor.execute('ALTER TABLE %s RENAME TO %s' % (qn(table), qn(legacy_table)))
+    # LIKE copies only check constraints
+    cursor.execute('CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+                   'PARTITION BY RANGE (%s)' % (qn(table), qn(legacy_table), qn('request_timestamp')))
+    # Primary key of the partitioned table must contain the partitioning column, the attached partition must have
+    # the same primary key
+    cursor.execute('ALTER TABLE %s ADD PRIMARY KEY (%s, %s)' % (qn(table), qn(pk_column), qn('request_timestamp')))
+    cursor.execute("SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p'",
+                   [qn(legacy_table)])
+    for constraint_name, in cursor.fetchall():
+        cursor.execute('ALTER TABLE %s DROP CONSTRAINT %s' % (qn(legacy_table), qn(constraint_name)))
+    cursor.execute('ALTER TABLE %s ADD PRIMARY KEY (%s, %s)' % (qn(legacy_table), qn(pk_column),
+                                                               qn('request_timestamp')))
+    cursor.execute("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+                   "WHERE conrelid = %s::regclass AND contype = 'f'", [qn(legacy_table)])
+    for constraint_name, definition in cursor.fetchall():
+        cursor.execute('ALTER TABLE %s ADD CONSTRAINT %s %s' % (qn(table), qn(constraint_name), definition))
+    for i, columns in enumerate(PARTITIONED_INDEXES):
+        cursor.execute('CREATE INDEX %s ON %s (%s)' % (
+            qn('%s_partitioned_%s' % (table, i)), qn(table), ', '.join(qn(column) for column in columns)
+        ))
+    cursor.execute('ALTER TABLE %s ATTACH PARTITION %s FOR VALUES FROM (MINVALUE) TO (%%s)' % (
+        qn(table), qn(legacy_table)), [end])
+    # Primary key sequence is owned by the legacy table, it would prevent dropping of the legacy partition
+    own_sequence(cursor, qn, legacy_table)
+    cursor.execute('CREATE TABLE %s PARTITION OF %s DEFAULT' % (qn(get_default_partition_name()), qn(table)))
+    return Partition(legacy_table, None, end)
+
+
+def create_partitions(period=LOG_PARTITIONING, ahead=LOG_PARTITIONS_AHEAD):
+    """
+    Creates missing partitions from the current period to the given number of periods ahead. Partitions continue
+    from the end of the last existing partition, if the period was changed the first created partition is shorter
+    so the ranges neither overlap nor leave gaps.
+    """
+    connection = get_connection()
+    qn = connection.ops.quote_name
+    partitions = get_partitions(connection)
+    covered_until = max([partition.end for partition in partitions if partition.end] or [None])
+
+    table = get_table_name()
+    default_partition = get_default_partition_name()
+    created = []
+    cursor = connection.cursor()
+    cursor.execute('CREATE TABLE IF NOT EXISTS %s PARTITION OF %s DEFAULT' % (qn(default_partition), qn(table)))
+    start = get_period_start(timezone.now(), period)
+    for i in range(ahead + 1):
+        end = start + PERIODS[period]
+        if covered_until is None or end > covered_until:
+            # Partitions of the previous period can end inside of the current one
+            start = max(start, covered_until) if covered_until is not None else start
+            partition = Partition(get_partition_name(start), start, end)
+            cursor.execute('SELECT 1 FROM %s WHERE %s >= %%s AND %s < %%s LIMIT 1' % (
+                qn(default_partition), qn('request_timestamp'), qn('request_timestamp')), [start, end])
+            if cursor.fetchone() is None:
+                cursor.execute('CREATE TABLE IF NOT EXISTS %s PARTITION OF %s FOR VALUES FROM (%%s) TO (%%s)' % (
+                    qn(partition.name), qn(table)), [start, end])
+            else:
+                # Range partition cannot be created while the default partition contains requests of the range
+                with transaction.atomic(using=connection.alias):
+                    cursor.execute('ALTER TABLE %s DETACH PARTITION %s' % (qn(table), qn(default_partition)))
+                    cursor.execute('CREATE TABLE IF NOT EXISTS %s PARTITION OF %s FOR VALUES FROM (%%s) TO (%%s)' % (
+                        qn(partition.name), qn(table)), [start, end])
+                    cursor.execute('WITH moved AS (DELETE FROM %s WHERE %s >= %%s AND %s < %%s RETURNING *) '
+                                   'INSERT INTO %s SELECT * FROM moved' % (
+                                       qn(default_partition), qn('request_timestamp'), qn('request_timestamp'),
+                                       qn(partition.name)), [start, end])
+                    cursor.execute('ALTER TABLE %s ATTACH PARTITION %s DEFAULT' % (qn(table), qn(default_partition)))
+            created.append(partition)
+        start = end
+    return created
+
+
+def drop_partitions(cutoff):
+    """
+    Detaches and drops partitions which contain only requests older than the cutoff, every partition is dropped in
+    its own transaction.
+    """
+    connection = get_connection()
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+
+    dropped = []
+    for partition in get_partitions(connection):
+        if partition.end is not None and partition.end <= cutoff:
+            with transaction.atomic(using=connection.alias):
+                own_sequence(cursor, qn, partition.name)
+                cursor.execute('ALTER TABLE %s DETACH PARTITION %s' % (qn(get_table_name()), qn(partition.name)))
+                cursor.execute('DROP TABLE %s' % qn(partition.name))
+            dropped.append(partition)
+    return dropped
@@ -0,0 +1,95 @@
+import threading
+import time
+
+from django.db import connections, router, DatabaseError
+
+from .config import LOG_DATABASE, THROTTLING_DATABASE, THROTTLING_DATABASE_MAX_LAG
+
+
+class LogRouter(object):
+    """
+    Routes logged requests and rollups to the LOG_DATABASE alias, the dedicated database can have its own
+    connection settings (e.g. CONN_MAX_AGE or the connection pooler). The user reference of logged requests has
+    no database constraint, users are loaded from their own database and they are not joined with the logged
+    requests (other models are not restricted by the router). Add the router to DATABASE_ROUTERS setting.
+    """
+
+    app_label = 'security'
+
+    def _is_log_model(self, model):
+        return model._meta.app_label == self.app_label
+
+    def db_for_read(self, model, **hints):
+        return LOG_DATABASE if self._is_log_model(model) else None
+
+    def db_for_write(self, model, **hints):
+        return LOG_DATABASE if self._is_log_model(model) else None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if self._is_log_model(obj1.__class__) or self._is_log_model(obj2.__class__):
+            return True
+        return None
+
+    def allow_migrate(self, db, model):
+        if self._is_log_model(model):
+            return db == LOG_DATABASE
+        return None
+
+    # Prior to Django 1.7
+    allow_syncdb = allow_migrate
+
+
+class ReplicaLag(object):
+    """
+    Lag of the PostgreSQL replica is loaded at most once per check_interval seconds. Lag of other databases is not
+    known and it is considered zero.
+    """
+
+    check_interval = 1
+
+    def __init__(self, using):
+        self.using = using
+        self._lag = None
+        self._checked = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        connection = connections[self.using]
+        if connection.vendor != 'postgresql':
+            return 0
+        cursor = connection.cursor()
+        cursor.execute('SELECT EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())')
+        lag = cursor.fetchone()[0]
+        # Primary database has no replay timestamp
+        return float(lag) if lag is not None else 0
+
+    def get(self):
+        now = time.time()
+        with self._lock:
+            if self._checked is None or now - self._checked >= self.check_interval:
+                try:
+                    self._lag = self._load()
+                except DatabaseError:
+                    self._lag = None
+                self._checked = now
+            return self._lag
+
+
+_replica_lag = None
+
+
+def get_throttling_database(model):
+    """
+    Returns alias of the database which is used for throttling counts of the model. THROTTLING_DATABASE (read
+    replica) is used only if its lag does not exceed THROTTLING_DATABASE_MAX_LAG seconds.
+    """
+    global _replica_lag
+    if THROTTLING_DATABASE is None:
+        return router.db_for_read(model)
+    if THROTTLING_DATABASE_MAX_LAG is not None:
+        if _replica_lag is None:
+            _replica_lag = ReplicaLag(THROTTLING_DATABASE)
+        lag = _replica_lag.get()
+        if lag is None or lag > THROTTLING_DATABASE_MAX_LAG:
+            return router.db_for_read(model)
+    return THROTTLING_DATABASE
@@ -0,0 +1,6 @@
+from django.dispatch import Signal
+
+
+# Sent by LogMiddleware at the end of every request, timings are durations of the request processing phases
+# in microseconds (ip_resolution, log_preparation, throttling, throttling.<validator>, view, log_save)
+request_timings = Signal(providing_args=['request', 'logged_request', 'timings'])
@@ -0,0 +1,136 @@
+import hashlib
+import struct
+import threading
+
+from array import array
+
+from django.utils.encoding import force_bytes
+
+
+class CountMinSketch(object):
+    """
+    Approximate counts of keys in depth rows of width counters. Count of a key is never underestimated, with
+    probability 1 - 0.5 ** depth it is overestimated by at most 2 / width of the total count.
+    """
+
+    def __init__(self, width, depth, counters=None):
+        self.width = width
+        self.depth = depth
+        self.counters = array('L', counters) if counters is not None else array('L', [0]) * (width * depth)
+
+    def get_indexes(self, key):
+        # Indexes of all rows are derived from one digest (double hashing)
+        first, second = struct.unpack('<QQ', hashlib.md5(force_bytes(key)).digest())
+        return [row * self.width + (first + row * second) % self.width for row in range(self.depth)]
+
+    def add(self, indexes, count=1):
+        for index in indexes:
+            self.counters[index] += count
+
+    def merge(self, other):
+        for index, count in enumerate(other.counters):
+            if count:
+                self.counters[index] += count
+
+
+class DecayedCountMinSketch(object):
+    """
+    Count-min sketches of fixed timeframe windows, the count of the sliding window is approximated by the count of
+    the current window and the proportional part of the previous one. Sketches are updated in the process and every
+    merge_interval seconds the local increments are merged to the sketches shared through the cache.
+    """
+
+    key_prefix = 'security:sketch'
+    lock_timeout = 1
+
+    def __init__(self, timeframe, width, depth, merge_interval, cache):
+        self.timeframe = timeframe
+        self.width = width
+        self.depth = depth
+        self.merge_interval = merge_interval
+        self.cache = cache
+        # window -> (shared sketch loaded from the cache, local increments which were not merged yet)
+        self._windows = {}
+        self._next_merge = 0
+        self._lock = threading.Lock()
+
+    def get_cache_key(self, window):
+        return '%s:%s:%s:%s:%s' % (self.key_prefix, self.timeframe, self.width, self.depth, window)
+
+    def _create_sketch(self, counters=None):
+        return CountMinSketch(self.width, self.depth, counters)
+
+    def _get_window(self, window):
+        if window not in self._windows:
+            for old_window in [old_window for old_window in self._windows if old_window < window - 1]:
+                del self._windows[old_window]
+            # Shared sketches of windows which are new for the process (e.g. after restart) are loaded from the cache,
+            # therefore the decayed count does not start from zero
+            for new_window in (window - 1, window):
+                if new_window not in self._windows:
+                    self._windows[new_window] = (self._create_sketch(self.cache.get(self.get_cache_key(new_window))),
+                                                 self._create_sketch())
+        return self._windows[window]
+
+    def _estimate(self, window, indexes):
+        shared, local = self._windows.get(window, (None, None))
+        if shared is None:
+            return 0
+        return min(shared.counters[index] + local.counters[index] for index in indexes)
+
+    def increment(self, key, now):
+        """
+        Counts the key and returns its estimated count inside the timeframe.
+        """
+        window = int(now // self.timeframe)
+        with self._lock:
+            shared, local = self._get_window(window)
+            indexes = local.get_indexes(key)
+            local.add(indexes)
+            previous_weight = 1 - (now - window * self.timeframe) / float(self.timeframe)
+            count = self._estimate(window, indexes) + int(self._estimate(window - 1, indexes) * previous_weight)
+            merge = now >= self._next_merge
+            if merge:
+                self._next_merge = now + self.merge_interval
+        if merge:
+            self.merge()
+        return count
+
+    def _merge_window(self, window, increments):
+        key = self.get_cache_key(window)
+        if not any(increments.counters):
+            # Only the increments of other processes are loaded
+            return self._create_sketch(self.cache.get(key))
+
+        lock_key = '%s:lock' % key
+        # Cache add is atomic, it is used as a lock of the read-modify-write update
+        if not self.cache.add(lock_key, 1, self.lock_timeout):
+            return None
+        try:
+            shared = self._create_sketch(self.cache.get(key))
+            shared.merge(increments)
+            self.cache.set(key, shared.counters, 2 * self.timeframe)
+            return shared
+        finally:
+            self.cache.delete(lock_key)
+
+    def merge(self):
+        """
+        Merges local increments to the shared sketches, increments are kept for the next merge if the sketch is locked
+        by another process.
+        """
+        with self._lock:
+            increments = {}
+            for window, (shared, local) in self._windows.items():
+                increments[window] = local
+                self._windows[window] = (shared, self._create_sketch())
+
+        for window, local in increments.items():
+            shared = self._merge_window(window, local)
+            with self._lock:
+                if window in self._windows:
+                    current_shared, current_local = self._windows[window]
+                    if shared is None:
+                        current_local.merge(local)
+                        shared = current_shared
+                    self._windows[window] = (shared, current_local)
@@ -0,0 +1,238 @@
+import atexit
+import calendar
+import errno
+import fcntl
+import io
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+
+from django.core.urlresolvers import get_callable
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+
+from .models import LoggedRequest
+from .backup import BackupJSONEncoder, logged_request_to_row
+from .writebehind import get_logged_request_writer
+from .config import LOG_STORAGE, LOG_STORAGE_OPTIONS, LOG_WRITE_BEHIND, LOG_PAYLOAD_DEDUPLICATION
+
+
+logger = logging.getLogger('security.storage')
+
+
+def serialize_logged_request(logged_request):
+    return force_bytes(json.dumps(logged_request_to_row(logged_request), cls=BackupJSONEncoder,
+                                  separators=(',', ':')))
+
+
+def save_logged_requests(logged_requests):
+    for logged_request in logged_requests:
+        logged_request.save()
+
+
+class LogStorage(object):
+    """
+    Stores logged requests prepared by the middleware. Counter backend which counts the stored requests is used by
+    throttling validators if THROTTLING_COUNTER_BACKEND is not set.
+    """
+
+    counter_backend = 'security.counters.CacheCounterBackend'
+
+    def prepare_from_request(self, request):
+        return LoggedRequest.objects.prepare_from_request(request)
+
+    def store(self, logged_request):
+        raise NotImplementedError
+
+    def purge(self, cutoff):
+        """
+        Removes requests older than cutoff, returns the description of removed data.
+        """
+        raise NotImplementedError('Requests are not purged by %s' % self.__class__.__name__)
+
+
+class ModelLogStorage(LogStorage):
+    """
+    Stores requests to the LoggedRequest table, with LOG_WRITE_BEHIND setting by the background thread. Requests
+    are removed by the purgeloggedrequests command itself.
+    """
+
+    counter_backend = 'security.counters.DatabaseCounterBackend'
+
+    def store(self, logged_request):
+        if LOG_WRITE_BEHIND:
+            get_logged_request_writer().put(logged_request)
+        else:
+            if LOG_PAYLOAD_DEDUPLICATION:
+                LoggedRequest.objects.deduplicate_and_store((logged_request,), save_logged_requests)
+            else:
+                logged_request.save()
+
+
+class FileLogStorage(LogStorage):
+    """
+    Appends requests to local files in NDJSON format (ndjson) or as JSON prefixed by its 4 bytes length (length).
+    Every process writes to its own file which is rotated when it exceeds max_bytes or it is older than
+    max_age seconds. Writes are buffered and the file is synchronized to the disk at most every fsync_interval
+    seconds. Open files are locked by their writers, therefore purge does not remove files of idle processes.
+    """
+
+    NDJSON = 'ndjson'
+    LENGTH_PREFIXED = 'length'
+
+    EXTENSIONS = {
+        NDJSON: '.ndjson',
+        LENGTH_PREFIXED: '.bin',
+    }
+
+    def __init__(self, directory, record_format=NDJSON, max_bytes=100 * 1024 * 1024, max_age=3600,
+                 buffer_size=64 * 1024, fsync_interval=1):
+        assert record_format in self.EXTENSIONS, 'Unknown record format %s' % record_format
+
+        self.directory = directory
+        self.record_format = record_format
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.buffer_size = buffer_size
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._pid = None
+        self._file = None
+        self._file_path = None
+        self._opened = None
+        self._size = 0
+        self._synced = None
+        self._sequence = 0
+        atexit.register(self.close)
+
+    def _get_file_path(self, now):
+        # Sequence number distinguishes files of the process rotated within the same second
+        self._sequence += 1
+        return os.path.join(self.directory, 'requests-%s-%s-%s%s' % (
+            time.strftime('%Y%m%dT%H%M%S', time.gmtime(now)), os.getpid(), self._sequence,
+            self.EXTENSIONS[self.record_format]
+        ))
+
+    def _close(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+    def _open(self, now):
+        if self._pid == os.getpid():
+            self._close()
+        else:
+            # File of the parent process is not closed by the forked worker
+            self._pid = os.getpid()
+            self._file = None
+            self._sequence = 0
+        self._file_path = self._get_file_path(now)
+        self._file = io.open(self._file_path, 'ab', buffering=self.buffer_size)
+        # Shared lock is held until the file is closed, it is released with the file descriptor
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_SH)
+        self._opened = self._synced = now
+        self._size = self._file.tell()
+
+    def _should_rotate(self, now):
+        return (self._file is None or self._pid != os.getpid() or self._size >= self.max_bytes or
+                now - self._opened >= self.max_age)
+
+    def _encode(self, logged_request):
+        record = serialize_logged_request(logged_request)
+        if self.record_format == self.NDJSON:
+            return record + b'\n'
+        return struct.pack('>I', len(record)) + record
+
+    def store(self, logged_request):
+        data = self._encode(logged_request)
+        now = time.time()
+        with self._lock:
+            if self._should_rotate(now):
+                self._open(now)
+            self._file.write(data)
+            self._size += len(data)
+            if now - self._synced >= self.fsync_interval:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._synced = now
+
+    def close(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                self._close()
+
+    def get_files(self):
+        extension = self.EXTENSIONS[self.record_format]
+        return sorted(os.path.join(self.directory, file_name) for file_name in os.listdir(self.directory)
+                      if file_name.startswith('requests-') and file_name.endswith(extension))
+
+    def _is_open(self, file_path):
+        """
+        Returns True if the file is locked by its writer.
+        """
+        with open(file_path, 'rb') as file_in:
+            try:
+                fcntl.flock(file_in.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError) as ex:
+                if ex.errno in (errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK):
+                    return True
+                raise
+            fcntl.flock(file_in.fileno(), fcntl.LOCK_UN)
+            return False
+
+    def purge(self, cutoff):
+        """
+        Removes files which were last written before cutoff, files still open by their writers are kept.
+        """
+        if timezone.is_naive(cutoff):
+            cutoff = timezone.make_aware(cutoff, timezone.get_default_timezone())
+        cutoff_timestamp = calendar.timegm(cutoff.utctimetuple())
+        removed = 0
+        for file_path in self.get_files():
+            if (file_path != self._file_path and os.path.getmtime(file_path) < cutoff_timestamp and
+                    not self._is_open(file_path)):
+                os.remove(file_path)
+                removed += 1
+        return '%d files' % removed
+
+
+class SocketLogStorage(LogStorage):
+    """
+    Sends every request as one JSON datagram to the collector listening on the UNIX socket. The request thread never
+    waits for the collector, requests which cannot be sent are dropped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.dropped = 0
+        self._local = threading.local()
+
+    def _get_socket(self):
+        sock = getattr(self._local, 'socket', None)
+        if sock is None:
+            sock = self._local.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+        return sock
+
+    def store(self, logged_request):
+        try:
+            self._get_socket().sendto(serialize_logged_request(logged_request), self.path)
+        except socket.error as ex:
+            self.dropped += 1
+            logger.debug('Unable to send logged request to %s: %s', self.path, ex)
+
+
+_storage = None
+
+
+def get_log_storage():
+    global _storage
+    if _storage is None:
+        _storage = get_callable(LOG_STORAGE)(**LOG_STORAGE_OPTIONS)
+    return _storage
@@ -0,0 +1,114 @@
+from collections import Counter
+
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import SimpleTestCase
+
+from security.sketches import CountMinSketch, DecayedCountMinSketch
+
+
+class CountMinSketchTestCase(SimpleTestCase):
+
+    def test_indexes(self):
+        sketch = CountMinSketch(width=100, depth=4)
+        indexes = sketch.get_indexes('10.0.0.1')
+        self.assertEqual(indexes, CountMinSketch(width=100, depth=4).get_indexes('10.0.0.1'))
+        self.assertEqual(len(indexes), 4)
+        for row, index in enumerate(indexes):
+            self.assertTrue(row * 100 <= index < (row + 1) * 100)
+
+    def test_counts_are_not_underestimated(self):
+        sketch = CountMinSketch(width=20, depth=3)
+        counts = Counter('key%s' % (i % 97) for i in range(1000))
+        for key, count in counts.items():
+            sketch.add(sketch.get_indexes(key), count)
+        for key, count in counts.items():
+            estimate = min(sketch.counters[index] for index in sketch.get_indexes(key))
+            self.assertTrue(estimate >= count)
+
+    def test_error_bound(self):
+        sketch = CountMinSketch(width=200, depth=5)
+        counts = Counter('key%s' % (i % 500) for i in range(10000))
+        for key, count in counts.items():
+            sketch.add(sketch.get_indexes(key), count)
+        # Overestimates are bounded by 2 / width of the total count with high probability
+        bound = 2 * 10000 / 200
+        exceeded = sum(
+            1 for key, count in counts.items()
+            if min(sketch.counters[index] for index in sketch.get_indexes(key)) - count > bound
+        )
+        self.assertTrue(exceeded <= len(counts) * 0.5 ** 5 * 2)
+
+    def test_merge(self):
+        first, second = CountMinSketch(width=10, depth=2), CountMinSketch(width=10, depth=2)
+        first.add(first.get_indexes('a'), 2)
+        second.add(second.get_indexes('a'), 3)
+        second.add(second.get_indexes('b'))
+        first.merge(second)
+        self.assertEqual(min(first.counters[index] for index in first.get_indexes('a')), 5)
+        self.assertEqual(sum(first.counters), 2 * (5 + 1))
+
+    def test_counters(self):
+        sketch = CountMinSketch(width=10, depth=2)
+        sketch.add(sketch.get_indexes('a'))
+        self.assertEqual(list(CountMinSketch(10, 2, sketch.counters).counters), list(sketch.counters))
+
+
+class DecayedCountMinSketchTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = LocMemCache('security-sketch-tests', {})
+        self.cache.clear()
+
+    def get_sketch(self, merge_interval=0):
+        return DecayedCountMinSketch(timeframe=60, width=100, depth=4, merge_interval=merge_interval,
+                                     cache=self.cache)
+
+    def test_count_inside_of_window(self):
+        sketch = self.get_sketch()
+        for i in range(5):
+            count = sketch.increment('10.0.0.1', 600 + i)
+        self.assertEqual(count, 5)
+        self.assertEqual(sketch.increment('10.0.0.2', 610), 1)
+
+    def test_previous_window_decays(self):
+        sketch = self.get_sketch()
+        for i in range(10):
+            sketch.increment('10.0.0.1', 600 + i)
+        # A quarter of the window elapsed, three quarters of the previous window are counted
+        self.assertEqual(sketch.increment('10.0.0.1', 675), 1 + 7)
+        # Windows older than the previous one are not counted
+        self.assertEqual(sketch.increment('10.0.0.1', 780), 1)
+
+    def test_increments_are_shared(self):
+        first, second = self.get_sketch(), self.get_sketch()
+        for i in range(3):
+            first.increment('10.0.0.1', 600 + i)
+        self.assertEqual(second.increment('10.0.0.1', 605), 4)
+
+    def test_increments_are_merged_after_interval(self):
+        first, second = self.get_sketch(merge_interval=10), self.get_sketch(merge_interval=10)
+        for i in range(3):
+            first.increment('10.0.0.1', 600 + i)
+        # Only the first increment was merged, the interval has not elapsed yet
+        self.assertEqual(second.increment('10.0.0.1', 605), 2)
+        first.merge()
+        second.merge()
+        self.assertEqual(second.increment('10.0.0.1', 606), 5)
+
+    def test_previous_window_is_loaded_after_restart(self):
+        sketch = self.get_sketch()
+        for i in range(10):
+            sketch.increment('10.0.0.1', 600 + i)
+
+        restarted = self.get_sketch()
+        self.assertEqual(restarted.increment('10.0.0.1', 690), 1 + 5)
+
+    def test_locked_increments_are_kept(self):
+        sketch = self.get_sketch()
+        self.cache.add('%s:lock' % sketch.get_cache_key(10), 1)
+        for i in range(3):
+            sketch.increment('10.0.0.1', 600 + i)
+        self.assertIsNone(self.cache.get(sketch.get_cache_key(10)))
+        self.cache.delete('%s:lock' % sketch.get_cache_key(10))
+        sketch.merge()
+        self.assertEqual(self.get_sketch().increment('10.0.0.1', 610), 4)
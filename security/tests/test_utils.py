@@ -0,0 +1,103 @@
+from django.test import SimpleTestCase
+
+from security.utils import IPSet, parse_ip
+
+
+class ParseIPTestCase(SimpleTestCase):
+
+    def test_ipv4(self):
+        self.assertEqual(parse_ip('10.0.0.1'), (32, 0x0a000001))
+
+    def test_ipv6(self):
+        self.assertEqual(parse_ip('2001:db8::1'), (128, 0x20010db8000000000000000000000001))
+
+    def test_invalid(self):
+        for ip in ('', '10.0.0', '10.0.0.256', '2001:db8::g', 'localhost', None):
+            self.assertIsNone(parse_ip(ip))
+
+
+class IPSetTestCase(SimpleTestCase):
+
+    def test_addresses(self):
+        ip_set = IPSet(['10.0.0.1', '2001:db8::1'])
+        self.assertIn('10.0.0.1', ip_set)
+        self.assertIn('2001:db8::1', ip_set)
+        self.assertNotIn('10.0.0.2', ip_set)
+        self.assertNotIn('2001:db8::2', ip_set)
+
+    def test_ipv6_address_notations(self):
+        ip_set = IPSet(['2001:db8::1'])
+        self.assertIn('2001:0db8:0000:0000:0000:0000:0000:0001', ip_set)
+        self.assertIn('2001:DB8::1', ip_set)
+
+    def test_ipv4_network_boundaries(self):
+        ip_set = IPSet(['192.168.1.0/24'])
+        self.assertIn('192.168.1.0', ip_set)
+        self.assertIn('192.168.1.255', ip_set)
+        self.assertNotIn('192.168.0.255', ip_set)
+        self.assertNotIn('192.168.2.0', ip_set)
+
+    def test_ipv4_network_not_aligned_to_octets(self):
+        ip_set = IPSet(['10.0.0.16/28'])
+        self.assertIn('10.0.0.16', ip_set)
+        self.assertIn('10.0.0.31', ip_set)
+        self.assertNotIn('10.0.0.15', ip_set)
+        self.assertNotIn('10.0.0.32', ip_set)
+
+    def test_host_bits_of_network_are_ignored(self):
+        ip_set = IPSet(['10.1.2.3/8'])
+        self.assertIn('10.255.255.255', ip_set)
+        self.assertNotIn('11.0.0.0', ip_set)
+
+    def test_full_prefix_is_address(self):
+        ip_set = IPSet(['10.0.0.1/32', '2001:db8::1/128'])
+        self.assertEqual(len(ip_set.addresses), 2)
+        self.assertFalse(ip_set.networks)
+        self.assertIn('10.0.0.1', ip_set)
+        self.assertNotIn('10.0.0.0', ip_set)
+        self.assertIn('2001:db8::1', ip_set)
+
+    def test_zero_prefix_contains_all_addresses_of_the_family(self):
+        ip_set = IPSet(['0.0.0.0/0'])
+        self.assertIn('0.0.0.0', ip_set)
+        self.assertIn('255.255.255.255', ip_set)
+        self.assertNotIn('::1', ip_set)
+
+    def test_ipv6_network_boundaries(self):
+        ip_set = IPSet(['2001:db8::/32'])
+        self.assertIn('2001:db8::', ip_set)
+        self.assertIn('2001:db8:ffff:ffff:ffff:ffff:ffff:ffff', ip_set)
+        self.assertNotIn('2001:db7:ffff:ffff:ffff:ffff:ffff:ffff', ip_set)
+        self.assertNotIn('2001:db9::', ip_set)
+
+    def test_ipv6_network_inside_of_hextet(self):
+        ip_set = IPSet(['fe80::/10'])
+        self.assertIn('fe80::1', ip_set)
+        self.assertIn('febf:ffff::1', ip_set)
+        self.assertNotIn('fec0::1', ip_set)
+
+    def test_families_do_not_match_each_other(self):
+        ip_set = IPSet(['::/96', '0.0.0.0/8'])
+        # IPv6 address ::a00:1 has the same number as IPv4 address 10.0.0.1
+        self.assertNotIn('10.0.0.1', ip_set)
+        self.assertIn('::a00:1', ip_set)
+        self.assertIn('0.0.0.1', ip_set)
+        self.assertNotIn('::1:0:0:1', ip_set)
+
+    def test_multiple_prefix_lengths(self):
+        ip_set = IPSet(['10.0.0.0/8', '172.16.0.0/12', '192.168.1.1'])
+        self.assertIn('10.20.30.40', ip_set)
+        self.assertIn('172.31.255.255', ip_set)
+        self.assertNotIn('172.32.0.0', ip_set)
+        self.assertIn('192.168.1.1', ip_set)
+        self.assertNotIn('192.168.1.2', ip_set)
+
+    def test_invalid_and_empty_addresses_are_not_contained(self):
+        ip_set = IPSet(['0.0.0.0/0'])
+        self.assertNotIn('', ip_set)
+        self.assertNotIn(None, ip_set)
+        self.assertNotIn('not an ip', ip_set)
+
+    def test_invalid_items(self):
+        for item in ('10.0.0', '10.0.0.0/33', '10.0.0.0/-1', '10.0.0.0/x', '2001:db8::/129'):
+            self.assertRaises(ValueError, IPSet, [item])
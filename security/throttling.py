@@ -1,12 +1,15 @@
-from datetime import timedelta
+import hashlib
+import time
 
-from django.utils import timezone
+from django.utils.encoding import force_bytes
 from django.utils.translation import ugettext as _
 
-from ipware.ip import get_ip
-
 from .models import LoggedRequest
 from .exception import ThrottlingException
+from .counters import get_counter_backend
+from .config import THROTTLING_CACHE_NAME
+from .sketches import DecayedCountMinSketch
+from .utils import get_cache, get_request_info, get_request_timings
 
 
 class ThrottlingValidator(object):
@@ -16,48 +19,179 @@ class ThrottlingValidator(object):
         self.throttle_at = throttle_at
         self.description = description
 
+    def __str__(self):
+        return '%s(%s, %s)' % (self.__class__.__name__, self.timeframe, self.throttle_at)
+
+    def get_ban_timeout(self):
+        """
+        Returns number of seconds after which the throttled client can pass the validator again.
+        """
+        return self.timeframe
+
     def validate(self, request):
         if not self._validate(request):
-            raise ThrottlingException(self.description)
+            raise ThrottlingException(self.description, self)
 
     def _validate(self, request):
         raise NotImplemented
 
 
-class PerRequestThrottlingValidator(ThrottlingValidator):
+class CountThrottlingValidator(ThrottlingValidator):
+    """
+    Throttles request if count of the same requests inside the timeframe is greater than throttle_at.
+    Requests are counted by configured counter backend.
+    """
+
+    counter_field = None
+
+    def __init__(self, timeframe, throttle_at, description):
+        super(CountThrottlingValidator, self).__init__(timeframe, throttle_at, description)
+        get_counter_backend().register(timeframe, self.counter_field)
+
+    def get_counter_value(self, request):
+        raise NotImplementedError
+
+    def get_counter(self, request):
+        return self.timeframe, self.counter_field, self.get_counter_value(request)
+
+    def is_valid_count(self, count_same_requests):
+        return count_same_requests <= self.throttle_at
+
+    def _validate(self, request):
+        request_info = get_request_info(request)
+        timeframe, field, value = self.get_counter(request)
+        return self.is_valid_count(
+            get_counter_backend().count(timeframe, request_info.ip, request_info.path, **{field: value})
+        )
+
+
+class PerRequestThrottlingValidator(CountThrottlingValidator):
+
+    counter_field = 'method'
 
     def __init__(self, timeframe, throttle_at, description=_('Slow down')):
         super(PerRequestThrottlingValidator, self).__init__(timeframe, throttle_at, description)
 
-    def _validate(self, request):
-        count_same_requests = LoggedRequest.objects.filter(ip=get_ip(request), path=request.path,
-                                                           request_timestamp__gte=timezone.now() - timedelta(seconds=self.timeframe),
-                                                           method=request.method.upper())\
-                                                           .count()
-        return count_same_requests <= self.throttle_at
+    def get_counter_value(self, request):
+        return get_request_info(request).method
+
 
+class UnsuccessfulLoginThrottlingValidator(CountThrottlingValidator):
 
-class UnsuccessfulLoginThrottlingValidator(ThrottlingValidator):
+    counter_field = 'type'
 
     def __init__(self, timeframe, throttle_at, description=_('Too many login attempts')):
         super(UnsuccessfulLoginThrottlingValidator, self).__init__(timeframe, throttle_at, description)
 
-    def _validate(self, request):
-        count_same_requests = LoggedRequest.objects.filter(ip=get_ip(request), path=request.path,
-                                                           request_timestamp__gte=timezone.now() - timedelta(seconds=self.timeframe),
-                                                           type=LoggedRequest.UNSUCCESSFUL_LOGIN_REQUEST)\
-                                                       .count()
-        return count_same_requests <= self.throttle_at
+    def get_counter_value(self, request):
+        return LoggedRequest.UNSUCCESSFUL_LOGIN_REQUEST
+
 
+class SuccessfulLoginThrottlingValidator(CountThrottlingValidator):
 
-class SuccessfulLoginThrottlingValidator(ThrottlingValidator):
+    counter_field = 'type'
 
     def __init__(self, timeframe, throttle_at, description=_('You are logged too much times')):
         super(SuccessfulLoginThrottlingValidator, self).__init__(timeframe, throttle_at, description)
 
+    def get_counter_value(self, request):
+        return LoggedRequest.SUCCESSFUL_LOGIN_REQUEST
+
+
+class GCRAThrottlingValidator(ThrottlingValidator):
+    """
+    Generic cell rate algorithm, allows throttle_at requests with the same IP address, path and method per timeframe.
+    Only the theoretical arrival time of the next request is stored in the cache for every client, therefore the state
+    does not grow with the traffic and no logged requests are counted.
+    """
+
+    key_prefix = 'security:gcra'
+    lock_timeout = 1
+    lock_attempts = 10
+    lock_sleep = 0.001
+
+    def __init__(self, timeframe, throttle_at, description=_('Slow down')):
+        super(GCRAThrottlingValidator, self).__init__(timeframe, throttle_at, description)
+        self.emission_interval = timeframe / float(throttle_at)
+        self.cache = get_cache(THROTTLING_CACHE_NAME)
+
+    def get_ban_timeout(self):
+        # The next request is allowed after one emission interval
+        return self.emission_interval
+
+    def get_key(self, request):
+        request_info = get_request_info(request)
+        digest = hashlib.md5(force_bytes('%s|%s|%s' % (request_info.ip, request_info.path, request_info.method)))
+        return '%s:%s:%s:%s' % (self.key_prefix, self.timeframe, self.throttle_at, digest.hexdigest())
+
+    def _update(self, key, now):
+        theoretical_arrival_time = max(self.cache.get(key, now), now) + self.emission_interval
+        if theoretical_arrival_time - now > self.timeframe:
+            return False
+        self.cache.set(key, theoretical_arrival_time, int(theoretical_arrival_time - now) + 1)
+        return True
+
     def _validate(self, request):
-        count_same_requests = LoggedRequest.objects.filter(ip=get_ip(request), path=request.path,
-                                                       request_timestamp__gte=timezone.now() - timedelta(seconds=self.timeframe),
-                                                       type=LoggedRequest.SUCCESSFUL_LOGIN_REQUEST)\
-                                                       .count()
-        return count_same_requests <= self.throttle_at
+        key = self.get_key(request)
+        lock_key = '%s:lock' % key
+        now = time.time()
+        # Cache add is atomic, it is used as a lock of the read-modify-write update
+        for i in range(self.lock_attempts):
+            if self.cache.add(lock_key, 1, self.lock_timeout):
+                try:
+                    return self._update(key, now)
+                finally:
+                    self.cache.delete(lock_key)
+            time.sleep(self.lock_sleep)
+        # Lock owner is too slow, unlocked update is better than rejecting the request
+        return self._update(key, now)
+
+
+class HeavyHitterThrottlingValidator(ThrottlingValidator):
+    """
+    Throttles IP addresses which sent more than throttle_at requests to any paths inside the timeframe, so clients
+    which spread requests over many URLs are caught too. Requests are counted by the count-min sketch with fixed
+    width * depth counters per window, no per IP address state is stored. The sketch can overestimate counts of
+    the IP addresses which collide with heavy hitters, the width should be several times larger than
+    the count of requests per timeframe divided by throttle_at.
+    """
+
+    def __init__(self, timeframe, throttle_at, description=_('Too many requests'), width=2048, depth=4,
+                 merge_interval=1):
+        super(HeavyHitterThrottlingValidator, self).__init__(timeframe, throttle_at, description)
+        self.sketch = DecayedCountMinSketch(timeframe, width, depth, merge_interval,
+                                            get_cache(THROTTLING_CACHE_NAME))
+
+    def _validate(self, request):
+        return self.sketch.increment(get_request_info(request).ip, time.time()) <= self.throttle_at
+
+
+class ThrottlingPlan(object):
+    """
+    Validates request with the set of validators. Counts of all CountThrottlingValidator instances are obtained
+    from the counter backend by one call, validators are evaluated in the given order.
+    """
+
+    def __init__(self, validators):
+        self.validators = tuple(validators)
+        self.count_validators = tuple(validator for validator in self.validators
+                                      if isinstance(validator, CountThrottlingValidator))
+
+    def validate(self, request):
+        timings = get_request_timings(request)
+        counts = {}
+        if self.count_validators:
+            request_info = get_request_info(request)
+            with timings.measure('throttling.counts'):
+                counts = dict(zip(self.count_validators, get_counter_backend().count_many(
+                    request_info.ip, request_info.path,
+                    [validator.get_counter(request) for validator in self.count_validators]
+                )))
+
+        for validator in self.validators:
+            if validator in counts:
+                if not validator.is_valid_count(counts[validator]):
+                    raise ThrottlingException(validator.description, validator)
+            else:
+                with timings.measure('throttling.%s' % validator):
+                    validator.validate(request)
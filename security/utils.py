@@ -1,7 +1,197 @@
-import re
+import socket
+
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
+
+from django.utils import timezone
+
+from ipware.ip import get_ip
+
+from .config import LOG_HEADERS_ALLOWLIST, LOG_HEADERS_DENYLIST
+
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2 has no monotonic clock, default_timer is the most precise clock of the platform
+    from timeit import default_timer as monotonic
+
+
+def normalize_header_names(names):
+    """
+    Returns header names in the form of get_headers keys, e.g. User-Agent -> USER_AGENT.
+    """
+    return frozenset(name.upper().replace('-', '_') for name in names)
+
+
+LOGGED_HEADERS = normalize_header_names(LOG_HEADERS_ALLOWLIST) if LOG_HEADERS_ALLOWLIST is not None else None
+HIDDEN_HEADERS = normalize_header_names(LOG_HEADERS_DENYLIST)
 
 
 def get_headers(request):
-    regex = re.compile('^HTTP_')
-    return dict((regex.sub('', header), value) for (header, value)
-                in request.META.items() if header.startswith('HTTP_'))
+    """
+    Returns HTTP headers without HTTP_ prefix filtered by LOG_HEADERS_ALLOWLIST and LOG_HEADERS_DENYLIST.
+    """
+    headers = {}
+    for header, value in request.META.items():
+        if header.startswith('HTTP_'):
+            header = header[5:]
+            if (LOGGED_HEADERS is None or header in LOGGED_HEADERS) and header not in HIDDEN_HEADERS:
+                headers[header] = value
+    return headers
+
+
+def get_cache(name):
+    """
+    Returns cache instance for the alias, django.core.cache.get_cache is not available since Django 1.9.
+    """
+    try:
+        from django.core.cache import caches
+    except ImportError:
+        from django.core.cache import get_cache as get_cache_by_name
+        return get_cache_by_name(name)
+    else:
+        return caches[name]
+
+
+class BodyCaptureStream(object):
+    """
+    Wraps the request input stream and keeps only the first max_length bytes read from it, the rest of the body is
+    streamed to the reader without buffering.
+    """
+
+    def __init__(self, stream, max_length):
+        self.stream = stream
+        self.max_length = max_length
+        self.captured = b''
+        self.enabled = True
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def _capture(self, data):
+        if self.enabled and len(self.captured) < self.max_length:
+            self.captured += data[:self.max_length - len(self.captured)]
+        return data
+
+    def read(self, *args, **kwargs):
+        return self._capture(self.stream.read(*args, **kwargs))
+
+    def readline(self, *args, **kwargs):
+        return self._capture(self.stream.readline(*args, **kwargs))
+
+    def disable(self):
+        self.enabled = False
+        self.captured = b''
+
+    def get_captured(self):
+        """
+        Returns captured bytes, if the reader did not read enough bytes the rest is read from the stream.
+        """
+        if self.enabled and len(self.captured) < self.max_length:
+            self.read(self.max_length - len(self.captured))
+        return self.captured
+
+
+def parse_ip(ip):
+    """
+    Returns tuple (number of address bits, address as integer) or None for invalid address.
+    """
+    for family, bits in ((socket.AF_INET, 32), (socket.AF_INET6, 128)):
+        try:
+            packed = socket.inet_pton(family, ip)
+        except (socket.error, ValueError, TypeError):
+            continue
+        return bits, int(''.join('%02x' % byte for byte in bytearray(packed)), 16)
+    return None
+
+
+class IPSet(object):
+    """
+    Set of IPv4 and IPv6 addresses and CIDR networks. Addresses are stored in a hash set, networks in hash sets per
+    prefix length, therefore lookup costs one hash lookup per distinct prefix length.
+    """
+
+    def __init__(self, items=()):
+        self.addresses = set()
+        self.networks = defaultdict(set)
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        address, _, prefix_length = item.partition('/')
+        parsed = parse_ip(address)
+        if parsed is None:
+            raise ValueError('Invalid IP address or network %s' % item)
+
+        bits, number = parsed
+        prefix_length = int(prefix_length) if prefix_length else bits
+        if not 0 <= prefix_length <= bits:
+            raise ValueError('Invalid prefix length of network %s' % item)
+        if prefix_length == bits:
+            self.addresses.add(parsed)
+        else:
+            self.networks[(bits, prefix_length)].add(number >> (bits - prefix_length))
+
+    def __contains__(self, ip):
+        parsed = parse_ip(ip) if ip else None
+        if parsed is None:
+            return False
+        if parsed in self.addresses:
+            return True
+
+        bits, number = parsed
+        for (network_bits, prefix_length), networks in self.networks.items():
+            if network_bits == bits and number >> (bits - prefix_length) in networks:
+                return True
+        return False
+
+
+class RequestInfo(object):
+    """
+    Values derived from the request which are shared by the middleware, LoggedRequestManager and validators.
+    """
+
+    def __init__(self, request):
+        self.ip = get_ip(request)
+        self.path = request.path
+        self.method = request.method.upper()
+        self.timestamp = timezone.now()
+
+
+def get_request_info(request):
+    try:
+        return request._security_request_info
+    except AttributeError:
+        request_info = request._security_request_info = RequestInfo(request)
+        return request_info
+
+
+class RequestTimings(object):
+    """
+    Durations of the request processing phases in microseconds measured by the monotonic clock.
+    """
+
+    def __init__(self):
+        self.start = monotonic()
+        self.phases = OrderedDict()
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0) + int(seconds * 1000000)
+
+    @contextmanager
+    def measure(self, phase):
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.add(phase, monotonic() - start)
+
+    def get_elapsed(self):
+        return int((monotonic() - self.start) * 1000000)
+
+
+def get_request_timings(request):
+    """
+    Returns timings of the request, timings are not stored if the request was not processed by LogMiddleware.
+    """
+    return getattr(request, '_security_timings', None) or RequestTimings()
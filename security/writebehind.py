@@ -0,0 +1,230 @@
+import atexit
+import logging
+import os
+import random
+import threading
+import time
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import connections, router
+from django.utils import timezone
+from django.utils.six.moves import queue
+
+from .models import LoggedRequest, LoggedRequestRollup
+from .config import (LOG_WRITE_BEHIND_QUEUE_SIZE, LOG_WRITE_BEHIND_BATCH_SIZE, LOG_WRITE_BEHIND_FLUSH_INTERVAL,
+                     LOG_WRITE_BEHIND_OVERFLOW, LOG_WRITE_BEHIND_OVERFLOW_SAMPLE_RATE, LOG_PAYLOAD_DEDUPLICATION)
+
+
+logger = logging.getLogger('security.writebehind')
+
+
+class LoggedRequestWriter(object):
+    """
+    Stores logged requests in batches from a background thread. Requests are put to a bounded queue and written by
+    bulk_create when batch_size requests are collected or flush_interval seconds elapsed. Rollup increments are
+    aggregated per rollup bucket and written by the same thread after every batch.
+
+    When the queue is full the overflow policy is applied:
+        * block - the request thread waits for a free slot
+        * drop - the logged request is discarded
+        * sample - throttled, login and failed requests wait for a free slot, the other ones are kept with
+          probability sample_rate
+    """
+
+    BLOCK = 'block'
+    DROP = 'drop'
+    SAMPLE = 'sample'
+
+    def __init__(self, queue_size=LOG_WRITE_BEHIND_QUEUE_SIZE, batch_size=LOG_WRITE_BEHIND_BATCH_SIZE,
+                 flush_interval=LOG_WRITE_BEHIND_FLUSH_INTERVAL, overflow=LOG_WRITE_BEHIND_OVERFLOW,
+                 sample_rate=LOG_WRITE_BEHIND_OVERFLOW_SAMPLE_RATE):
+        assert overflow in (self.BLOCK, self.DROP, self.SAMPLE), 'Unknown overflow policy %s' % overflow
+
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.sample_rate = sample_rate
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        self._queue = None
+        # Queued but not stored requests (ip, path) -> {id: logged_request} for throttling counts
+        self._pending = defaultdict(dict)
+        # Not stored rollup increments (ip, path, method, type, minute) -> count, rollups which are being written
+        self._rollups = defaultdict(int)
+        self._writing_rollups = {}
+        atexit.register(self.stop)
+
+    def _ensure_started(self):
+        # The thread is started lazily in every worker process (e.g. after fork of the preloaded application)
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(self.queue_size)
+                    self._pending = defaultdict(dict)
+                    self._rollups = defaultdict(int)
+                    self._writing_rollups = {}
+                    self._thread = threading.Thread(target=self._run, name='security-log-writer')
+                    self._thread.daemon = True
+                    self._thread.start()
+                    self._pid = os.getpid()
+
+    def _is_important(self, logged_request):
+        return (logged_request.type != LoggedRequest.COMMON_REQUEST or
+                logged_request.status != LoggedRequest.FINE)
+
+    def _add_pending(self, logged_request):
+        with self._lock:
+            self._pending[(logged_request.ip, logged_request.path)][id(logged_request)] = logged_request
+
+    def _remove_pending(self, logged_requests):
+        with self._lock:
+            for logged_request in logged_requests:
+                key = (logged_request.ip, logged_request.path)
+                self._pending[key].pop(id(logged_request), None)
+                if not self._pending[key]:
+                    del self._pending[key]
+
+    def put(self, logged_request):
+        self._ensure_started()
+        # Request is pending before it is queued, because flusher can store it immediately
+        self._add_pending(logged_request)
+        if self.overflow == self.BLOCK:
+            self._queue.put(logged_request)
+        else:
+            try:
+                self._queue.put_nowait(logged_request)
+            except queue.Full:
+                if (self.overflow == self.SAMPLE and
+                        (self._is_important(logged_request) or random.random() < self.sample_rate)):
+                    self._queue.put(logged_request)
+                else:
+                    self._remove_pending((logged_request,))
+                    self.dropped += 1
+
+    def count_pending(self, timeframe, ip, path, **filters):
+        """
+        Returns count of queued requests which match throttling counter filters.
+        """
+        since = timezone.now() - timedelta(seconds=timeframe)
+        with self._lock:
+            return sum(
+                logged_request.sample_weight for logged_request in self._pending.get((ip, path), {}).values()
+                if logged_request.request_timestamp >= since and all(
+                    getattr(logged_request, field) == value for field, value in filters.items()
+                )
+            )
+
+    def increment_rollup(self, logged_request, count=1):
+        self._ensure_started()
+        key = (logged_request.ip, logged_request.path, logged_request.method, logged_request.type,
+               logged_request.request_timestamp.replace(second=0, microsecond=0))
+        with self._lock:
+            self._rollups[key] += count
+
+    def count_pending_rollups(self, ip, path, since):
+        """
+        Returns list of (minute, method, type, count) of not stored rollup increments of the IP address and path.
+        """
+        with self._lock:
+            return [
+                (minute, method, type, count)
+                for rollups in (self._rollups, self._writing_rollups)
+                for (rollup_ip, rollup_path, method, type, minute), count in rollups.items()
+                if rollup_ip == ip and rollup_path == path and minute >= since
+            ]
+
+    def _get_batch(self):
+        batch = []
+        deadline = None
+        while len(batch) < self.batch_size:
+            timeout = self.flush_interval if deadline is None else deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                logged_request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if logged_request is None:
+                return batch, True
+            batch.append(logged_request)
+            if deadline is None:
+                deadline = time.time() + self.flush_interval
+        return batch, False
+
+    def _close_connection(self):
+        connections[router.db_for_write(LoggedRequest)].close()
+
+    def _write(self, batch):
+        try:
+            if LOG_PAYLOAD_DEDUPLICATION:
+                LoggedRequest.objects.deduplicate_and_store(batch, LoggedRequest.objects.bulk_create)
+            else:
+                LoggedRequest.objects.bulk_create(batch)
+        except Exception:
+            logger.exception('Unable to store %s logged requests', len(batch))
+            self._close_connection()
+        finally:
+            self._remove_pending(batch)
+
+    def _write_rollups(self):
+        with self._lock:
+            rollups = self._writing_rollups = self._rollups
+            self._rollups = defaultdict(int)
+        try:
+            for (ip, path, method, type, minute), count in rollups.items():
+                LoggedRequestRollup.objects.increment(ip, path, method, type, minute, count)
+        except Exception:
+            logger.exception('Unable to store %s request rollups', len(rollups))
+            self._close_connection()
+        finally:
+            with self._lock:
+                self._writing_rollups = {}
+
+    def _run(self):
+        stopped = False
+        while not stopped:
+            batch, stopped = self._get_batch()
+            if batch:
+                self._write(batch)
+            if self._rollups:
+                self._write_rollups()
+        # Requests queued after the stop sentinel
+        batch = []
+        while True:
+            try:
+                logged_request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if logged_request is not None:
+                batch.append(logged_request)
+        if batch:
+            self._write(batch)
+        if self._rollups:
+            self._write_rollups()
+        self._close_connection()
+
+    def stop(self, timeout=None):
+        """
+        Flushes all queued requests and stops the background thread, is called on the interpreter exit.
+        """
+        if self._pid == os.getpid() and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_logged_request_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = LoggedRequestWriter()
+    return _writer
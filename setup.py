@@ -20,7 +20,7 @@ setup(
     license='LGPL',
     package_dir={'security': 'security'},
     include_package_data=True,
-    packages=find_packages(),
+    packages=find_packages(exclude=('benchmarks', 'benchmarks.*')),
     classifiers=[
         'Development Status :: 0 - Beta',
         'Environment :: Web Environment',